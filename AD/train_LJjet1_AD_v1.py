@@ -10,7 +10,6 @@
 '''
 
 import uproot
-from ROOT import TFile, TTree, TObject
 import numpy as np
 import tensorflow as tf
 from keras import backend as K
@@ -19,49 +18,118 @@ from tensorflow.keras import Model
 from matplotlib import pyplot as plt 
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
-from array import array
 import time
+import json
+import tempfile
+import os
+import sys
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 class SimpleAE: 
 
-    def __init__(self, all_sig_filepaths, sig_filepath, bgd_filepath, tree_name):
+    # LJjet1 variables used as AE inputs, in column order 
+    features = ["LJjet1_m", "LJjet1_jvt", "LJjet1_width", "LJjet1_EMfrac", "LJjet1_eta", "LJjet1_pt"]
+    # fractions of background entries in the test / validation sets for streaming training
+    test_size = 0.5
+    val_size  = 0.1
+
+    def __init__(self, all_sig_filepaths, sig_filepath, bgd_filepath, tree_name, step_size="100 MB", moments_cache="ae_feature_moments.json"):
         self.sig_filepath = sig_filepath 
         self.bgd_filepath = bgd_filepath
         self.tree_name    = tree_name
         self.all_sig_filepaths = all_sig_filepaths
+        # chunk size for uproot.iterate (entries or memory size string)
+        self.step_size    = step_size
+        # sidecar file with per-file feature moments used for the normalisation
+        self.moments_cache = moments_cache
 
     def data_prep(self, filepath):
         """
         Open the root file and return an array of variables to train AE
+        All features are read in one chunked pass straight into a preallocated float32 array
         """
-        f=uproot.open(filepath)
-        tree = f[self.tree_name]
+        start = time.time()
+        with uproot.open(filepath) as f:
+            n_entries = f[self.tree_name].num_entries
 
-        #convert branches to arrays 
-        evnt_number   = tree.arrays("eventNumber")["eventNumber"]
-        LJjet1_m      = tree.arrays("LJjet1_m")["LJjet1_m"]   
-        LJjet1_jvt    = tree.arrays("LJjet1_jvt")["LJjet1_jvt"]      
-        LJjet1_width  = tree.arrays("LJjet1_width")["LJjet1_width"]     
-        LJjet1_EMfrac = tree.arrays("LJjet1_EMfrac")["LJjet1_EMfrac"]
-        LJjet1_eta    = tree.arrays("LJjet1_eta")["LJjet1_eta"]
-        LJjet1_pt     = tree.arrays("LJjet1_pt")["LJjet1_pt"]
+        evnt_number = np.empty(n_entries, dtype=np.int64)
+        array_forAD = np.empty((n_entries, len(self.features)), dtype=np.float32)
 
-        evnt_number   = np.array(evnt_number).reshape(len(evnt_number), 1)
-        LJjet1_m      = np.array(LJjet1_m).reshape(len(LJjet1_m), 1)
-        LJjet1_jvt    = np.array(LJjet1_jvt).reshape(len(LJjet1_jvt), 1)
-        LJjet1_width  = np.array(LJjet1_width).reshape(len(LJjet1_width), 1)
-        LJjet1_EMfrac = np.array(LJjet1_EMfrac).reshape(len(LJjet1_EMfrac), 1)
-        LJjet1_eta    = np.array(LJjet1_eta).reshape(len(LJjet1_eta), 1)
-        LJjet1_pt     = np.array(LJjet1_pt).reshape(len(LJjet1_pt), 1)
+        # fill chunk by chunk - only one step_size worth of branches is held in memory at once
+        first = 0
+        for chunk in uproot.iterate({filepath: self.tree_name}, ["eventNumber"] + self.features, step_size=self.step_size, library="np"):
+            last = first + len(chunk["eventNumber"])
+            evnt_number[first:last] = chunk["eventNumber"]
+            for col, feature in enumerate(self.features):
+                array_forAD[first:last, col] = chunk[feature]
+            first = last
 
-        # track events for mse score - eventNumber's repeated 
-        track_ev = np.linspace(0, len(evnt_number)-1, num=len(evnt_number))
-        track_evnts   = np.array(track_ev).reshape(len(track_ev), 1)
+        # track events for mse score - eventNumber's repeated, so keep the entry index instead
+        track_evnts = np.arange(n_entries)
 
-        array_forAD = np.hstack((LJjet1_m, LJjet1_jvt, LJjet1_width, LJjet1_EMfrac, LJjet1_eta, LJjet1_pt)) 
+        print(f"Loaded {n_entries} events from {filepath} in {time.time()-start:.2f}s")
+        return evnt_number, array_forAD, track_evnts
 
-        print("Loaded data")
-        return evnt_number, array_forAD, np.array(track_evnts)
+    def feature_moments(self, filepath):
+        """
+        Return the count, sum and sum of squares of each AE feature in a file 
+        Stored in a sidecar json cache keyed by path, size and mtime so each file is only read once 
+        """
+        stat  = os.stat(filepath)
+        path  = os.path.abspath(filepath)
+        cache = {}
+        if os.path.exists(self.moments_cache):
+            with open(self.moments_cache) as f:
+                cache = json.load(f)
+
+        entry = cache.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns and entry["features"] == self.features:
+            return entry["count"], np.array(entry["sum"]), np.array(entry["sumsq"])
+
+        # accumulate in float64 chunk by chunk, no need to hold the file in memory 
+        start = time.time()
+        count = 0
+        sums  = np.zeros(len(self.features))
+        sumsq = np.zeros(len(self.features))
+        for chunk in uproot.iterate({filepath: self.tree_name}, self.features, step_size=self.step_size, library="np"):
+            for col, feature in enumerate(self.features):
+                values = chunk[feature].astype(np.float64)
+                sums[col]  += values.sum()
+                sumsq[col] += np.dot(values, values)
+            count += len(chunk[self.features[0]])
+        print(f"Computed feature moments for {filepath} in {time.time()-start:.2f}s")
+
+        cache[path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "features": self.features,
+                       "count": count, "sum": sums.tolist(), "sumsq": sumsq.tolist()}
+        with open(self.moments_cache, "w") as f:
+            json.dump(cache, f, indent=1)
+        return count, sums, sumsq
+
+    def fitted_scaler(self):
+        """
+        StandardScaler for the combined background + all signals, merged from the per-file moments
+        """
+        count = 0
+        sums  = np.zeros(len(self.features))
+        sumsq = np.zeros(len(self.features))
+        for filepath in [self.bgd_filepath] + self.all_sig_filepaths:
+            n, s, s2 = self.feature_moments(filepath)
+            count += n
+            sums  += s
+            sumsq += s2
+
+        mean = sums / count
+        var  = np.maximum(sumsq / count - mean**2, 0.)
+        scaler = StandardScaler()
+        scaler.mean_  = mean
+        scaler.var_   = var
+        # same zero-variance treatment as StandardScaler.fit
+        scaler.scale_ = np.where(var > 0, np.sqrt(var), 1.)
+        scaler.n_samples_seen_ = count
+        scaler.n_features_in_  = len(self.features)
+        return scaler
 
     def normalise(self, file_tonorm): 
         """
@@ -70,23 +138,8 @@ class SimpleAE:
         # Signal file or Background to normalise 
         evnt_num, arrToNorm, track_evnts = self.data_prep(file_tonorm)
 
-        # Load all signal / background data to ensure same normalisation for Bkgs and signals 
-        evnt_num_bkg, bkg_array, track_evnts_bkg = self.data_prep(self.bgd_filepath)
-
-        sig_arrays = []
-        for sig_filepath in self.all_sig_filepaths:
-            evnt_num_sig, sig_array, track_evnts_sig = self.data_prep(sig_filepath)
-            print(sig_array)
-            sig_arrays.append(sig_array)
-            print(sig_array.shape)
-        print(bkg_array.shape)
-       
-        # Stack signals and Bakgrounds 
-        combined_array = np.vstack([bkg_array] + sig_arrays)
-
-        #Fit and transform data 
-        scaler = StandardScaler()
-        fitted_scaler = scaler.fit(combined_array)
+        # Same normalisation for Bkgs and signals - built from cached moments, no event data reread
+        fitted_scaler = self.fitted_scaler()
         normalised_data = fitted_scaler.transform(arrToNorm)
 
         return evnt_num, normalised_data, track_evnts
@@ -97,9 +150,11 @@ class SimpleAE:
         """
         # Get normalised data - store evnt nums used in training/testing 
         evnt_nums, normed_data, track_evnts_data = self.normalise(file_tonorm)
-        norm_input_data = np.hstack([track_evnts_data, normed_data])
-        train_LJjet1, test_LJjet1 = train_test_split(norm_input_data,random_state=64,test_size=.5, shuffle=True)
-        return train_LJjet1, test_LJjet1, track_evnts_data
+        # split the entry index rather than stacking it onto the data - same split, no float copy 
+        evnt_nums_train, evnt_nums_test = train_test_split(track_evnts_data,random_state=64,test_size=.5, shuffle=True)
+        train_LJjet1 = normed_data[evnt_nums_train]
+        test_LJjet1  = normed_data[evnt_nums_test]
+        return train_LJjet1, test_LJjet1, evnt_nums_train, evnt_nums_test, track_evnts_data
 
     def model_AE(self, input_shape, encoding_dim, hidden_nodes=None):
         """
@@ -135,10 +190,7 @@ class SimpleAE:
         Train the AE
         """
         #train / test split for backgrounds 
-        training_data, testing_data, evnt_nums = self.data_prep_train_test(self.bgd_filepath)
-        #remove evnt number 
-        trimmed_training_data = training_data[:, 1:]
-        trimmed_testing_data  = testing_data[:, 1:]
+        trimmed_training_data, trimmed_testing_data, evnt_nums_train, evnt_nums_test, evnt_nums = self.data_prep_train_test(self.bgd_filepath)
         inp_dim = trimmed_training_data.shape[1]
         print(f"Input dimensions for training : {trimmed_training_data.shape[0], trimmed_training_data.shape[1]}")
     
@@ -158,22 +210,125 @@ class SimpleAE:
         recon_test_data = BasicAE.predict(trimmed_testing_data)
         mse_test_data   = self.mse_loss_pt(trimmed_testing_data, recon_test_data)
 
-        return history, BasicAE, recon_test_data, mse_test_data, training_data, testing_data, evnt_nums
+        return history, BasicAE, recon_test_data, mse_test_data, evnt_nums_train, evnt_nums_test, evnt_nums
+
+    def entry_split(self, entries):
+        """
+        Deterministic per-event train (0) / validation (1) / test (2) assignment from the entry number 
+        Multiplicative hash so the same event lands in the same set in every chunk and every run
+        """
+        u = ((entries.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2**32)) / 2.**32
+        split = np.zeros(len(entries), dtype=np.int8)
+        split[u < self.test_size + self.val_size] = 1
+        split[u < self.test_size] = 2
+        return split
+
+    def stream_chunks(self, filepath, subset):
+        """
+        Yield (entries, normalised float32 features) for one subset (0 train, 1 validation, 2 test) chunk by chunk
+        """
+        scaler = self.fitted_scaler()
+        mean   = scaler.mean_.astype(np.float32)
+        scale  = scaler.scale_.astype(np.float32)
+        first  = 0
+        for chunk in uproot.iterate({filepath: self.tree_name}, self.features, step_size=self.step_size, library="np"):
+            n = len(chunk[self.features[0]])
+            entries = np.arange(first, first + n)
+            first += n
+            mask = self.entry_split(entries) == subset
+            data = np.empty((mask.sum(), len(self.features)), dtype=np.float32)
+            for col, feature in enumerate(self.features):
+                data[:, col] = chunk[feature][mask]
+            data -= mean
+            data /= scale
+            yield entries[mask], data
+
+    def streaming_dataset(self, filepath, subset, batch_size_, shuffle_buffer=0):
+        """
+        tf.data pipeline reading miniT chunks from uproot, normalised on the fly 
+        """
+        def generator():
+            for entries, data in self.stream_chunks(filepath, subset):
+                # counted per subset so validation passes don't inflate the training rate
+                self.n_streamed[subset] += len(data)
+                yield data
+
+        dataset = tf.data.Dataset.from_generator(generator, output_signature=tf.TensorSpec(shape=(None, len(self.features)), dtype=tf.float32))
+        dataset = dataset.unbatch()
+        if shuffle_buffer:
+            dataset = dataset.shuffle(shuffle_buffer, seed=64, reshuffle_each_iteration=True)
+        dataset = dataset.batch(batch_size_).map(lambda x: (x, x), num_parallel_calls=tf.data.AUTOTUNE)
+        return dataset.prefetch(tf.data.AUTOTUNE)
+
+    def train_streaming(self, enc_dim, epochs_, batch_size_, shuffle_buffer=1000000):
+        """
+        Train the AE out-of-core: the background is streamed from the root file every epoch, never fully in memory
+        Returns the same tuple as train, recon_test_data is not kept (None)
+        """
+        inp_dim = len(self.features)
+        if enc_dim >= inp_dim:
+            raise Exception("Need data compression")
+        BasicAE = self.model_AE(input_shape=inp_dim, encoding_dim=enc_dim)
+        BasicAE.summary()
+
+        train_ds = self.streaming_dataset(self.bgd_filepath, 0, batch_size_, shuffle_buffer)
+        val_ds   = self.streaming_dataset(self.bgd_filepath, 1, batch_size_)
+
+        # training 
+        self.n_streamed = {0: 0, 1: 0}
+        start = time.time()
+        history = BasicAE.fit(train_ds, validation_data=val_ds, epochs=epochs_, verbose = 1)
+        elapsed = time.time() - start
+        print(f"Streamed {self.n_streamed[0]} training events in {elapsed:.1f}s : {self.n_streamed[0]/elapsed:.0f} training events/s")
+        print(f"Streamed {self.n_streamed[1]} validation events")
+
+        # Test on Background sub-set, chunk by chunk 
+        print("Reconstruction on testing data")
+        evnt_nums_test, mse_test_data = [], []
+        for entries, data in self.stream_chunks(self.bgd_filepath, 2):
+            recon = BasicAE.predict(data, batch_size=batch_size_, verbose=0)
+            evnt_nums_test.append(entries)
+            mse_test_data.append(np.mean(np.square(data - recon), axis=-1, dtype=np.float32))
+        evnt_nums_test = np.concatenate(evnt_nums_test)
+        mse_test_data  = np.concatenate(mse_test_data)
+
+        # train + validation entries are the ones with isTest = 0
+        evnt_nums = np.arange(self.feature_moments(self.bgd_filepath)[0])
+        evnt_nums_train = evnt_nums[self.entry_split(evnt_nums) != 2]
+
+        # ru_maxrss is in kB on linux, bytes on macOS 
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.**2 if sys.platform == "darwin" else 1024.)
+        print(f"Peak RSS : {peak_rss:.0f} MB")
+
+        return history, BasicAE, None, mse_test_data, evnt_nums_train, evnt_nums_test, evnt_nums
 
-    def mse_signals(self, trained_model):
+    def mse_signals(self, trained_model, n_workers=None, batch_size=65536, model_path=None):
         """
-        Evaluate the mse score for the signal sample
+        Evaluate the mse score for every signal sample, one file per worker process
+        Returns a list of float32 numpy arrays in the order of all_sig_filepaths
+        The model is handed to the workers through model_path, a temporary directory (removed afterwards) if None
         """
-        mse_scores = []
-        for signal in self.all_sig_filepaths:
-            # Get normalised signals data - store evnt nums used in training/testing 
-            evnt_nums, normed_data, track_evnts = self.normalise(signal)
-            #predict on signal 
-            recon_signals = trained_model.predict(normed_data)
-            #MSE score 
-            mse_signals   = self.mse_loss_pt(normed_data, recon_signals)
-            mse_scores.append(mse_signals)
-        return mse_scores
+        if not self.all_sig_filepaths:
+            return []
+        scaler = self.fitted_scaler()
+        if n_workers is None:
+            n_workers = min(len(self.all_sig_filepaths), os.cpu_count())
+        n_workers = max(n_workers, 1)
+
+        start = time.time()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # workers load the saved model once, TF state can't be shared across processes
+            if model_path is None:
+                model_path = os.path.join(tmpdir, "ae_model.keras")
+            trained_model.save(model_path)
+            # spawn rather than fork, TF is not fork safe once initialised
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=context, initializer=_init_scorer,
+                                     initargs=(self, model_path, scaler.mean_, scaler.scale_, n_workers)) as pool:
+                mse_scores = dict(pool.map(_score_file, self.all_sig_filepaths, [batch_size]*len(self.all_sig_filepaths)))
+        print(f"Scored {len(mse_scores)} signal files with {n_workers} workers in {time.time()-start:.1f}s")
+
+        return [mse_scores[signal] for signal in self.all_sig_filepaths]
 
     def plot_loss(self, loss, val_loss, scale, name = None, save=False, ylim = False):
         """
@@ -218,7 +373,7 @@ class SimpleAE:
         Plot the mse score of testing bkg vs signal
         """
 
-        scores = [in_tensor.numpy() for in_tensor in inp_scores]
+        scores = [np.asarray(in_tensor) for in_tensor in inp_scores]
         ##get range of data and bsm for bin counts 
         mse_data = scores[0]
         mse_bsm  = np.concatenate(scores[1:])
@@ -250,134 +405,78 @@ class SimpleAE:
         return plt.show()
 
 
+    def write_scores(self, source_filepath, output_name, train_test_tag, mse_scores):
+        """
+        Write isTest and mse to a small friend file, aligned entry by entry with the tree in source_filepath 
+        Read back with tree.AddFriend("<tree_name>_AD", output_name)
+        """
+        start = time.time()
+        with uproot.open(source_filepath) as f:
+            n_entries = f[self.tree_name].num_entries
+        if len(mse_scores) != n_entries:
+            raise Exception(f"{len(mse_scores)} scores for {n_entries} entries in {source_filepath}")
+
+        with uproot.recreate(output_name) as f:
+            f[f"{self.tree_name}_AD"] = {"isTest": np.asarray(train_test_tag, dtype=np.float32), "mse": np.asarray(mse_scores, dtype=np.float32)}
+
+        print(f"Wrote {n_entries} scores for {source_filepath} to {output_name} in {time.time()-start:.2f}s")
+
     def add_Branch_Bkg(self, evnt_nums, evnt_nums_train, evnt_nums_test, mse_score_test, output_name):
         """
-        Create a new root file from the bkg file that contains a tag for: 
+        Create a friend root file for the bkg file that contains a tag for: 
         train_test_tag = 0 if training dataset, 1 if testing 
         mse_scores = -999 if training, actual mse score if testing 
         """
-        print(f"Creating Root File : {output_name}")
-        evnt_numbers   = evnt_nums
-        print("Starting indexing ")
-        start1 = time.time()
-        indices_training = (evnt_nums_train).astype(int)
-        indices_testing  = (evnt_nums_test).astype(int)
-        
-        # combine train / test limits 
-        mse_combined = np.zeros((len(evnt_numbers),))
-        
-        # Set score for training data to -999 (shouldn't be used)
-        mse_combined[[indices_training]] = -999
-        for i, num in enumerate(indices_testing) : mse_combined[num] = mse_score_test[i]
+        indices_training = np.asarray(evnt_nums_train).astype(int)
+        indices_testing  = np.asarray(evnt_nums_test).astype(int)
 
-        #train_test_tag = np.zeros_like(evnt_numbers) 
-        train_test_tag =np.zeros((len(evnt_numbers),))
+        # combine train / test - set score for training data to -999 (shouldn't be used)
+        mse_combined = np.zeros(len(evnt_nums), dtype=np.float32)
+        mse_combined[indices_training] = -999
+        mse_combined[indices_testing]  = np.asarray(mse_score_test)
+
+        train_test_tag = np.zeros(len(evnt_nums), dtype=np.float32)
         train_test_tag[indices_testing] = 1 
 
+        self.write_scores(self.bgd_filepath, output_name, train_test_tag, mse_combined)
 
-        end1 = time.time()
-        print(f"Indexing took : {end1-start1}s")
-
-        input_file  = TFile.Open(self.bgd_filepath, "READ") 
-        end_f = time.time()
-        print(f"Opening file took : {end_f-end1}s")
-        output_file = TFile(output_name, "RECREATE")
-
-        for key in input_file.GetListOfKeys():
-            name = key.GetName()
-            obj  = key.ReadObj()
-
-            print(f"name : {name}")
-            print(f"obj : {obj}")
-            cycle = key.GetCycle()
-
-            #Change cycle number if file changes 
-            if name == "miniT" and obj.InheritsFrom("TTree") and cycle == 25:
-                print(f"Modifying bkg tree: {name}")
-                tree = obj
-                # Clone tree structure only
-                new_tree = tree.CloneTree(0)
-                
-                # Define new branches 
-                train_val = array("f", [0])
-                mse_val   = array("f", [0]) 
-                train_tag_branch = new_tree.Branch("isTest", train_val, "isTest/F")
-                mse_tag_branch   = new_tree.Branch("mse", mse_val, "mse/F")
-                print(f"Tree entries {tree.GetEntries()}")
-
-                # Loop over entries and fill new branch
-                for i in range(tree.GetEntries()):
-                    tree.GetEntry(i)
-                    # Assign train/test tag
-                    train_val[0] = train_test_tag[i]
-                    # Assign mse score
-                    mse_val[0] = mse_combined[i]
-                    # Fill tree
-                    new_tree.Fill()
-                new_tree.Write("miniT", TObject.kOverwrite)
-            elif name != "miniT":
-                # Write all other objects (TH1D, TH1F, TH1I, etc.) - don't write multiple cycles on miniT
-                obj.Write()
-
-        # Close files
-        output_file.Close()
-        input_file.Close()
-
-        end2 = time.time()
-        print(f"File creation took : {end2-end1}s")
-        return print(f"Cloned {self.bgd_filepath} to {output_name} and added the branches : isTest, mse")
-
-    def add_Branch_Sig(self, mse_score_sigs, output_name):
-        """
-        Create a new root file from the signal  file that contains a tag for: 
+    def add_Branch_Sig(self, mse_score_sigs, output_dir="."):
+        """
+        Create a friend root file <name>_AD.root for every signal in all_sig_filepaths that contains a tag for: 
         train_test_tag =  1 (all signals used as not used in training) 
         mse_scores = mse score 
         """
-        # Define train/test tag - all 1 
-        mse_test_score = mse_score_sigs[0]
-        train_test_tag = np.ones((len(mse_test_score),))
-
-        #Open original file + make new output file
-        input_file  = TFile.Open(self.sig_filepath, "READ") 
-        output_file = TFile(output_name, "RECREATE")
-
-        #loop over objects in input file 
-        for key in input_file.GetListOfKeys():
-            name = key.GetName()
-            obj  = key.ReadObj()
-
-            if name == "miniT" and obj.InheritsFrom("TTree"):
-                print(f"Modifying signal tree: {name}")
-                tree = obj
-                # Clone tree structure only
-                new_tree = tree.CloneTree(0)
-
-                # Define new branches 
-                train_val = array('f', [0])
-                mse_val   = array('f', [0])
-                train_tag_branch = new_tree.Branch("isTest", train_val, "isTest/F")
-                mse_tag_branch   = new_tree.Branch("mse", mse_val, "mse/F")
-                
-                print(f"Tree entries {tree.GetEntries()}")
-
-                # Loop over entries and fill new branch
-                for i in range(tree.GetEntries()):
-                    tree.GetEntry(i)
-                    # Assign train/test tag
-                    train_val[0] = train_test_tag[i]
-                    # Assign mse score
-                    mse_val[0] = mse_test_score[i]
-                    #Fill tree
-                    new_tree.Fill()
-                new_tree.Write()
-            else:
-                # Write all other objects (TH1D, TH1F, TH1I, etc.)
-                obj.Write()
-
-        # Close files
-        output_file.Close()
-        input_file.Close()
-        return print(f"Cloned {self.sig_filepath} to {output_name} and added the branches : isTest, mse")
+        for sig_filepath, mse_score_sig in zip(self.all_sig_filepaths, mse_score_sigs):
+            train_test_tag = np.ones(len(mse_score_sig), dtype=np.float32)
+            base_name   = os.path.basename(sig_filepath).split('.')[0]
+            output_name = os.path.join(output_dir, f"{base_name}_AD.root")
+            self.write_scores(sig_filepath, output_name, train_test_tag, mse_score_sig)
+
+# Per worker state for SimpleAE.mse_signals, set once per process by _init_scorer
+_scorer = {}
+
+def _init_scorer(ae, model_path, mean, scale, n_workers):
+    # share the cores between the workers rather than each TF grabbing all of them
+    tf.config.threading.set_intra_op_parallelism_threads(max(1, os.cpu_count() // n_workers))
+    _scorer["ae"]    = ae
+    _scorer["model"] = tf.keras.models.load_model(model_path, compile=False)
+    _scorer["mean"]  = mean.astype(np.float32)
+    _scorer["scale"] = scale.astype(np.float32)
+
+def _score_file(filepath, batch_size):
+    """
+    Normalise one file and return its per-event mse, predicted in fixed size batches 
+    """
+    evnt_nums, data, track_evnts = _scorer["ae"].data_prep(filepath)
+    data -= _scorer["mean"]
+    data /= _scorer["scale"]
+
+    mse = np.empty(len(data), dtype=np.float32)
+    for first in range(0, len(data), batch_size):
+        batch = data[first:first+batch_size]
+        recon = np.asarray(_scorer["model"].predict_on_batch(batch))
+        mse[first:first+batch_size] = np.mean(np.square(batch - recon), axis=-1)
+    return filepath, mse
 
 def main():
     tree_name = "miniT"
@@ -388,9 +487,15 @@ def main():
     epochs_ = 50
     batch_size_ = 2000
 
+    # stream the background from file instead of loading it in memory
+    streaming = False
+
     model_AE = SimpleAE(all_signals, sigFile, bgdFile, tree_name)
     #Training + data prep 
-    history, BasicAE, recon_test_data, mse_test_data, training_data, testing_data, evnt_nums_full  = model_AE.train(enc_dim, epochs_, batch_size_)
+    if streaming:
+        history, BasicAE, recon_test_data, mse_test_data, Evnt_num_training, Evnt_num_testing, evnt_nums_full  = model_AE.train_streaming(enc_dim, epochs_, batch_size_)
+    else:
+        history, BasicAE, recon_test_data, mse_test_data, Evnt_num_training, Evnt_num_testing, evnt_nums_full  = model_AE.train(enc_dim, epochs_, batch_size_)
     #Plot loss 
     model_AE.plot_loss(history.history['loss'], history.history['val_loss'], 'log', name = None, save=True, ylim = False)
     #Get Signal Scores 
@@ -399,11 +504,9 @@ def main():
     #Plot Signal vs Background MSE 
     model_AE.plot_mse(inp_scores=[mse_test_data]+mse_sig_scores, bins_size=0.1, scale='log', labels=['wjets', 'frvz_vbf_500757'], colours=['r', 'b', 'g'], name=None, xlim=None, save=True)
     #Add branch to root file with train/test tag - BKG
-    Evnt_num_training = training_data[:, 0]
-    Evnt_num_testing  = testing_data[:, 0]
-    model_AE.add_Branch_Bkg(evnt_nums_full, Evnt_num_training, Evnt_num_testing, mse_test_data, output_name=f"wjets_strong_sh227.root")
+    model_AE.add_Branch_Bkg(evnt_nums_full, Evnt_num_training, Evnt_num_testing, mse_test_data, output_name=f"wjets_strong_sh227_AD.root")
     #Add branch to root file with train/test tag - SIG
-    model_AE.add_Branch_Sig(mse_sig_scores, output_name=f"frvz_vbf_500757.root")
+    model_AE.add_Branch_Sig(mse_sig_scores, output_dir=".")
 
     return 0 
 
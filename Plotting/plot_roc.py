@@ -26,6 +26,10 @@ class plotter:
         self.RATIOMIN = 0.0
         self.RATIOMAX = 10.0
 
+        # Queue newplot calls and fill every histogram of a sample in one event loop before drawing
+        self.BATCH = True
+        self.plotqueue = []
+
     def run(self):
 
         # Set ATLAS style
@@ -44,7 +48,33 @@ class plotter:
         self.newplot(infiles, 'LJjet1_DPJtagger', 'DPJtagger BG vs Signal', '', 'vbffilter', 50, 0., 1.)
         self.newplot(infiles, 'mse', 'mse BG vs Signal', '', 'vbffilter', 50, 0., 5.)
 
-    def newplot(self, files, variable, variablename, units, region, nbins, xmin, xmax, ymin = 0, ymax = 1, PLOTSIGNALS = True, ratioplot = '',forcebins=False, plotLOG=True):
+        # Fill and draw all queued plots
+        self.drawqueue()
+        print('Histogram cache: {} hits, {} misses'.format(sample.sample.cachehits, sample.sample.cachemisses))
+
+    def drawqueue(self):
+
+        # Fill all queued histograms, one event loop per sample, then draw each plot
+        booked = plotutils.plotutils().bookqueue(self.plotqueue, self.REGIONS_FILE, self.MCWEIGHTSTRING)
+        for plot in self.plotqueue:
+            self.newplot(samples = booked[plot['files']], **plot)
+        self.plotqueue = []
+
+    def regionplots(self, files, variable, variablename, units, regions = None, **kwargs):
+
+        # Queue the same plot in several regions, all regions of the regions file by default
+        # In batch mode every region and variable of a sample is filled in the same event loop
+        if regions is None:
+            regions = list(plotutils.plotutils().regions(self.REGIONS_FILE))
+        for region in regions:
+            self.newplot(files, variable, variablename, units, region, **kwargs)
+
+    def newplot(self, files, variable, variablename, units, region, nbins, xmin, xmax, ymin = 0, ymax = 1, PLOTSIGNALS = True, ratioplot = '',forcebins=False, plotLOG=True, samples=None):
+
+        # Queue the plot, the histograms are filled together in drawqueue
+        if self.BATCH and samples is None:
+            self.plotqueue.append(dict(files=files, variable=variable, variablename=variablename, units=units, region=region, nbins=nbins, xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, PLOTSIGNALS=PLOTSIGNALS, ratioplot=ratioplot, forcebins=forcebins, plotLOG=plotLOG))
+            return
       
         # Create directory for plots
         if region not in os.listdir('./'):
@@ -67,7 +97,7 @@ class plotter:
         else:
             forceblind = False
 
-        pu.setup(c, files, self.REGIONS_FILE, variable, variablename, units, region, self.MCWEIGHTSTRING, nbins, xmin, xmax, ymin, ymax, self.PLOTLOG, PLOTSIGNALS, self.PLOTARROWS, forceblind, forcebins)
+        pu.setup(c, files, self.REGIONS_FILE, variable, variablename, units, region, self.MCWEIGHTSTRING, nbins, xmin, xmax, ymin, ymax, self.PLOTLOG, PLOTSIGNALS, self.PLOTARROWS, forceblind, forcebins, samples)
         # Draw histograms
         pu.drawhists()
         #pu.fit('Data')
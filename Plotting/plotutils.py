@@ -1,12 +1,38 @@
-import ROOT, json, sys
+import ROOT, json, sys, re
 from ROOT import TLegend, gROOT, TFile, TH1D, THStack, TPad, TArrow, TLine
 import numpy as np
-import io
+import io, os, time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import sample
 
+def fillsample(name, metadata, requests, variations, legacy, usecache):
+
+    # Fill one sample, run in a worker process by plotutils.fillsamples - the histograms are sent back pickled
+    # legacy fills each request with TTree::Draw, otherwise all requests share one RDataFrame event loop
+    # variations holds the region weight variations of each request, booked next to the nominal request
+    gROOT.SetBatch()
+    sample.sample.usecache = usecache
+    tempsample = sample.sample(name, metadata)
+    hits, misses = sample.sample.cachehits, sample.sample.cachemisses
+    requests = list(requests)
+    for request, regionvariations in zip(list(requests), variations):
+        requests += tempsample.__variationrequests__(request, regionvariations).values()
+    if legacy:
+        for request in requests:
+            tempsample.__gethist__(*request)
+            tempsample.hists[tempsample.__histkey__(*request)] = tempsample.hist
+    else:
+        tempsample.__bookhists__(requests)
+    return tempsample.hists, sample.sample.cachehits - hits, sample.sample.cachemisses - misses
+
 class plotutils:
 
+    # Number of samples filled at the same time, set to 1 to fill them one after another in this process
+    nworkers = os.cpu_count()
+    regionscache = {}
+
     def setuplegend(self, x0 = 0.65, y0 = 0.7, x1 = 0.88, y1 = 0.88):
 
         legend = TLegend(x0,y0,x1,y1) 
@@ -63,11 +89,18 @@ class plotutils:
         
         # Construct stack of backgrounds and total background sample
         temperror = 0.0
+        shifts = {}
         for background in tempbackgrounds:
             self.samples[background.name] = background.hist
             if background.blind == False:
                 if background.unitynorm == True:
-                    background.hist.Scale(1/background.hist.Integral())
+                    norm = 1/background.hist.Integral()
+                    background.hist.Scale(norm)
+                    for varhist in background.varhists.values():
+                        varhist.Scale(norm)
+                # Weight variations shift the total background coherently across samples
+                for name, varhist in background.varhists.items():
+                    shifts[name] = shifts.get(name, 0) + self.bincontents(varhist) - self.bincontents(background.hist)
                     
                 thstack.Add(background.hist)
                 if len(self.bkgerrors) == 0:
@@ -84,6 +117,10 @@ class plotutils:
             for bin in range(totalSM.GetNbinsX()):
                 totalSM.SetBinError(bin+1, self.bkgerrors[bin])
                 print('Bin {} error = {}'.format(bin+1, self.bkgerrors[bin]))                 
+        elif len(shifts) != 0:
+            systerrors = self.systematicerrors(shifts)
+            for bin in range(totalSM.GetNbinsX()):
+                totalSM.SetBinError(bin+1, np.sqrt(totalSM.GetBinError(bin+1)**2 + systerrors[bin]**2))
 
         self.samples['totalSM'] = totalSM
         #self.samples['totalSMerror'] = totalSMerror
@@ -95,6 +132,60 @@ class plotutils:
         gROOT.cd()
         return   
 
+    def binarrays(self, hist):
+
+        # Views of the bin contents and errors of a TH1D, including under- and overflow
+        nbins = hist.GetNbinsX() + 2
+        contents = np.frombuffer(hist.GetArray(), dtype=np.float64, count=nbins)
+        if hist.GetSumw2N() == 0:
+            return contents, np.sqrt(np.abs(contents))
+        return contents, np.sqrt(np.frombuffer(hist.GetSumw2().GetArray(), dtype=np.float64, count=nbins))
+
+    def bincontents(self, hist):
+
+        # Copy of the in-range bin contents
+        return self.binarrays(hist)[0][1:-1].copy()
+
+    def emptyhist(self, histname):
+
+        if self.forcebins == []:
+            temphist = TH1D(histname,histname,self.nbins,self.xmin,self.xmax)
+        else:
+            numbins = len(self.forcebins) - 1
+            temphist = TH1D(histname,histname,numbins,self.forcebins)
+        temphist.Sumw2()
+        return temphist
+
+    def ratiohists(self, numerator, denominator, histname, errorname):
+
+        # numerator / denominator with the numerator's relative error, and an error band at 1 with the denominator's relative error
+        # bins where either histogram is empty are left at 0
+        numcontents, numerrors = self.binarrays(self.samples[numerator])
+        dencontents, denerrors = self.binarrays(self.samples[denominator])
+        filled = (numcontents != 0) & (dencontents != 0)
+        ratio = np.divide(numcontents, dencontents, out=np.zeros_like(numcontents), where=filled)
+        ratioerror = np.divide(ratio*numerrors, numcontents, out=np.zeros_like(numcontents), where=filled)
+        banderror = np.divide(denerrors, dencontents, out=np.zeros_like(dencontents), where=filled)
+
+        ratiohist = self.emptyhist(histname)
+        errorhist = self.emptyhist(errorname)
+        ratiohist.SetContent(ratio)
+        ratiohist.SetError(ratioerror)
+        errorhist.SetContent(np.ones_like(ratio))
+        errorhist.SetError(banderror)
+        return ratiohist, errorhist
+
+    def systematicerrors(self, shifts):
+
+        # shifts are the per-bin total background changes of each weight variation
+        # variations named <name>_up/<name>_down form a symmetric envelope, the groups are added in quadrature
+        envelopes = {}
+        for name, shift in shifts.items():
+            group = re.sub('_?(up|down)$', '', name, flags=re.IGNORECASE)
+            envelopes[group] = np.maximum(envelopes.get(group, 0), np.abs(shift))
+        print('Weight variations in total background error: {}'.format(', '.join(sorted(envelopes))))
+        return np.sqrt(sum(envelope**2 for envelope in envelopes.values()))
+
     def signals(self, tempsignals):
 
         # Plot individual signal samples
@@ -124,7 +215,7 @@ class plotutils:
         self.data = tempdata    
         return    
 
-    def setup(self, canvas, files, regions_file, variable, variablename, units, region, weights, nbins, xmin, xmax, ymin, ymax, plotlog, plotsignals, plotarrows, forceblind, useregionbins):
+    def setup(self, canvas, files, regions_file, variable, variablename, units, region, weights, nbins, xmin, xmax, ymin, ymax, plotlog, plotsignals, plotarrows, forceblind, useregionbins, samples = None):
 
         self.xmax = xmax
         self.xmin = xmin
@@ -144,21 +235,15 @@ class plotutils:
         self.ratioerror = {}
         cuts, self.forceblind, forcebins, bkgerrors = self.loadregions(regions_file, region)
         print('Region blinded: {}'.format(self.forceblind))   
-        if len(forcebins) != 0 and useregionbins:
-            from array import array
-            forcebins = map(float, forcebins.replace(' ', '').split(','))
-            self.forcebins = array('f',forcebins)
-            if len(bkgerrors) != 0:
-                print('Using following per-bin errors: {}'.format(bkgerrors))
-                bkgerrors = map(float, bkgerrors.replace(' ', '').split(','))
-                self.bkgerrors = array('f',bkgerrors)
-            else:
-                self.bkgerrors = []
+        self.forcebins, self.bkgerrors = self.regionbins(forcebins, bkgerrors, useregionbins)
+        regionvariations = self.regionvariations(regions_file, region)
+        if samples is None:
+            tempbackgrounds, tempsignals, tempdata = self.loadsamples(files)
+            self.applyselections(tempbackgrounds, tempsignals, tempdata, variable, cuts, weights, nbins, xmin, xmax, self.forcebins, regionvariations)
         else:
-            self.forcebins = [] 
-            self.bkgerrors = [] 
-        tempbackgrounds, tempsignals, tempdata = self.loadsamples(files)
-        self.applyselections(tempbackgrounds, tempsignals, tempdata, variable, cuts, weights, nbins, xmin, xmax, self.forcebins)
+            # histograms already filled by bookqueue
+            tempbackgrounds, tempsignals, tempdata = samples
+            self.usebookedhists(tempbackgrounds + tempsignals + tempdata, (variable, cuts, weights, nbins, xmin, xmax, self.forcebins), regionvariations)
         self.backgrounds(tempbackgrounds)
         self.signals(tempsignals)
         self.data(tempdata)    
@@ -219,42 +304,17 @@ class plotutils:
         #denominator_hist = self.samples[denominator].Clone()
         #ratioplot.Divide(denominator_hist)
 
-        histname = 'datamc'
-        errorname = 'datamcerror'
-        if self.forcebins == []:
-            ratioplot = TH1D(histname,histname,self.nbins,self.xmin,self.xmax)
-            errorhist = TH1D(errorname,errorname,self.nbins,self.xmin,self.xmax)
-        else:
-            numbins = len(self.forcebins) - 1
-            ratioplot = TH1D(histname,histname,numbins,self.forcebins)
-            errorhist = TH1D(errorname,errorname,numbins,self.forcebins)
-        ratioplot.Sumw2() 
-        for bin in range(1,ratioplot.GetNbinsX()+1):
-            binnum = self.samples[numerator].Clone().GetBinContent(bin)
-            binden = self.samples[denominator].Clone().GetBinContent(bin)
-            numerror = self.samples[numerator].Clone().GetBinError(bin)
-            denerror = self.samples[denominator].Clone().GetBinError(bin)
-            if binnum != 0 and binden != 0:
-                ratio = binnum/binden
-                #ratioerror = np.sqrt((numerror/binnum)**2 + (denerror/binden))
-                ratioerror = denerror/binden
-            else:
-                ratio = 0    
-                ratioerror = 0
-            ratioplot.SetBinContent(bin, ratio)
-            ratioplot.SetBinError(bin, ratioerror)
-            errorhist.SetBinContent(bin, 1.0)
-            errorhist.SetBinError(bin, ratioerror)
-            ratioplot.SetMarkerColorAlpha(1,1)
-            ratioplot.SetFillColor(0)
-            ratioplot.SetLineColor(0)
-            ratioplot.SetLineWidth(2)
-            errorhist.SetFillColor(1)
-            errorhist.SetFillStyle(3013)
-            errorhist.SetMarkerColorAlpha(0,0)
-            self.ratio['ratio'] = ratioplot
-            self.ratioerror['ratioerror'] = errorhist
-            self.ratioplot = ratioplot
+        ratioplot, errorhist = self.ratiohists(numerator, denominator, 'datamc', 'datamcerror')
+        ratioplot.SetMarkerColorAlpha(1,1)
+        ratioplot.SetFillColor(0)
+        ratioplot.SetLineColor(0)
+        ratioplot.SetLineWidth(2)
+        errorhist.SetFillColor(1)
+        errorhist.SetFillStyle(3013)
+        errorhist.SetMarkerColorAlpha(0,0)
+        self.ratio['ratio'] = ratioplot
+        self.ratioerror['ratioerror'] = errorhist
+        self.ratioplot = ratioplot
         
         #ratioplot.SetFillColor(2)
         #ratioplot.SetFillStyle(3004)
@@ -304,39 +364,14 @@ class plotutils:
         index = 0
         for num, den in zip(numerator,denominator):
 
-            histname = 'temphist{}'.format(index)
-            errorname = 'errorhist{}'.format(index)
-
-            if self.forcebins == []:
-                temphist = TH1D(histname,histname,self.nbins,self.xmin,self.xmax)
-                errorhist = TH1D(errorname,errorname,self.nbins,self.xmin,self.xmax)
-            else:
-                numbins = len(self.forcebins) - 1
-                temphist = TH1D(histname,histname,numbins,self.forcebins)
-                errorhist = TH1D(errorname,errorname,numbins,self.forcebins)
-            temphist.Sumw2()    
-            for bin in range(temphist.GetNbinsX()):
-                binnum = self.samples[num].Clone().GetBinContent(bin)
-                binden = self.samples[den].Clone().GetBinContent(bin)
-                numerror = self.samples[num].Clone().GetBinError(bin)
-                denerror = self.samples[den].Clone().GetBinError(bin)
-                if binnum != 0 and binden != 0:
-                    ratio = binnum/binden
-                    ratioerror = np.sqrt((numerror/binnum)**2 + (denerror/binden))
-                else:
-                    ratio = 0    
-                    ratioerror = 0
-                temphist.SetBinContent(bin, ratio)
-                temphist.SetBinError(bin, ratioerror)
-                errorhist.SetBinContent(bin, 1.0)
-                errorhist.SetBinError(bin, ratioerror)
-                temphist.SetMarkerColorAlpha(0,0)
-                temphist.SetFillColor(0)
-                temphist.SetLineColor(colour[index])
-                temphist.SetLineWidth(2)
-                errorhist.SetFillColor(colour[index])
-                errorhist.SetFillStyle(3013)
-                errorhist.SetMarkerColorAlpha(0,0)
+            temphist, errorhist = self.ratiohists(num, den, 'temphist{}'.format(index), 'errorhist{}'.format(index))
+            temphist.SetMarkerColorAlpha(0,0)
+            temphist.SetFillColor(0)
+            temphist.SetLineColor(colour[index])
+            temphist.SetLineWidth(2)
+            errorhist.SetFillColor(colour[index])
+            errorhist.SetFillStyle(3013)
+            errorhist.SetMarkerColorAlpha(0,0)
 
             self.lines['line{}'.format(index)] = temphist
             self.lineerrors['line{}'.format(index)] = errorhist
@@ -438,11 +473,17 @@ class plotutils:
                 
         return tempbackgrounds, tempsignals, tempdata
 
+    def regions(self, cuts_file):
+
+        # Regions file is read once per process and shared by all plots
+        if cuts_file not in plotutils.regionscache:
+            rawjsonfile = io.open(cuts_file, encoding='utf-8')
+            plotutils.regionscache[cuts_file] = json.load(rawjsonfile).get('regions')
+        return plotutils.regionscache[cuts_file]
+
     def loadregions(self, cuts_file, region):
 
-        rawjsonfile = io.open(cuts_file, encoding='utf-8')
-        jsondict = json.load(rawjsonfile)
-        regions = jsondict.get('regions')
+        regions = self.regions(cuts_file)
         tempcuts = ''
         if region not in regions:
             sys.exit('Region not found, please check and try again.')
@@ -455,16 +496,86 @@ class plotutils:
             bkgerrors = regions[region]['bkgerrors']
             return tempcuts, blind, forcebins, bkgerrors                  
 
-    def applyselections(self, tempbackgrounds, tempsignals, tempdata, variable, cuts, weights, nbins, xmin, xmax, forcebins):
+    def regionvariations(self, cuts_file, region):
 
-        for background in tempbackgrounds:
-            background.__gethist__(variable, cuts, weights, nbins, xmin, xmax, forcebins)
-            
-        for signal in tempsignals:
-            signal.__gethist__(variable, cuts, weights, nbins, xmin, xmax, forcebins)
-            
-        for data in tempdata:
-            data.__gethist__(variable, cuts, weights, nbins, xmin, xmax, forcebins)         
+        # Optional {name: weights} of alternate weight expressions for this region
+        return self.regions(cuts_file)[region].get('variations', {})
+
+    def regionbins(self, forcebins, bkgerrors, useregionbins):
+
+        if len(forcebins) != 0 and useregionbins:
+            from array import array
+            forcebins = map(float, forcebins.replace(' ', '').split(','))
+            forcebins = array('f',forcebins)
+            if len(bkgerrors) != 0:
+                print('Using following per-bin errors: {}'.format(bkgerrors))
+                bkgerrors = map(float, bkgerrors.replace(' ', '').split(','))
+                bkgerrors = array('f',bkgerrors)
+            else:
+                bkgerrors = []
+        else:
+            forcebins = [] 
+            bkgerrors = [] 
+        return forcebins, bkgerrors
+
+    def histrequest(self, regions_file, variable, region, weights, nbins, xmin, xmax, useregionbins):
+
+        # The (variable, cuts, weights, binning) that setup would fill for this plot
+        cuts, blind, forcebins, bkgerrors = self.loadregions(regions_file, region)
+        forcebins, bkgerrors = self.regionbins(forcebins, bkgerrors, useregionbins)
+        return (variable, cuts, weights, nbins, xmin, xmax, forcebins)
+
+    def bookqueue(self, plots, regions_file, weights):
+
+        # Fill the histograms of all queued plots, one event loop per sample
+        # plots are the newplot keyword dictionaries, returns {files: (backgrounds, signals, data)}
+        booked = {}
+        for files in dict.fromkeys(plot['files'] for plot in plots):
+            requests = [self.histrequest(regions_file, plot['variable'], plot['region'], weights, plot['nbins'], plot['xmin'], plot['xmax'], plot['forcebins']) for plot in plots if plot['files'] == files]
+            variations = [self.regionvariations(regions_file, plot['region']) for plot in plots if plot['files'] == files]
+            tempbackgrounds, tempsignals, tempdata = self.loadsamples(files)
+            self.fillsamples(tempbackgrounds + tempsignals + tempdata, requests, variations)
+            booked[files] = (tempbackgrounds, tempsignals, tempdata)
+        return booked
+
+    def usebookedhists(self, samples, request, regionvariations = {}):
+
+        # Fresh copy for this plot, as backgrounds/signals/data may rescale sample.hist
+        gROOT.cd()
+        for tempsample in samples:
+            tempsample.hist = tempsample.hists[tempsample.__histkey__(*request)].Clone()
+            tempsample.varhists = {name: tempsample.hists[tempsample.__histkey__(*varrequest)].Clone() for name, varrequest in tempsample.__variationrequests__(request, regionvariations).items()}
+
+    def fillsamples(self, samples, requests, variations = None, legacy = False):
+
+        # Fill the requested histograms of every sample into sample.hists, one worker process per sample
+        # variations are the region weight variations of each request, filled in the same event loop
+        if variations is None:
+            variations = [{} for request in requests]
+        # Largest files first so the slowest sample starts straight away
+        start = time.time()
+        samples = sorted(samples, key = lambda tempsample: os.path.getsize(tempsample.filepath) if os.path.exists(tempsample.filepath) else 0, reverse = True)
+        nworkers = min(self.nworkers, len(samples))
+        if nworkers <= 1:
+            for tempsample in samples:
+                tempsample.hists.update(fillsample(tempsample.name, tempsample.metadata, requests, variations, legacy, sample.sample.usecache)[0])
+        else:
+            # spawn rather than fork, ROOT does not survive being forked with open files and interpreter state
+            with ProcessPoolExecutor(max_workers = nworkers, mp_context = multiprocessing.get_context('spawn')) as pool:
+                futures = [pool.submit(fillsample, tempsample.name, tempsample.metadata, requests, variations, legacy, sample.sample.usecache) for tempsample in samples]
+                for tempsample, future in zip(samples, futures):
+                    hists, hits, misses = future.result()
+                    tempsample.hists.update(hists)
+                    sample.sample.cachehits += hits
+                    sample.sample.cachemisses += misses
+        print('Filled {} samples with {} workers in {:.1f}s'.format(len(samples), nworkers, time.time() - start))
+
+    def applyselections(self, tempbackgrounds, tempsignals, tempdata, variable, cuts, weights, nbins, xmin, xmax, forcebins, regionvariations = {}):
+
+        request = (variable, cuts, weights, nbins, xmin, xmax, forcebins)
+        tempsamples = tempbackgrounds + tempsignals + tempdata
+        self.fillsamples(tempsamples, [request], [regionvariations], legacy = True)
+        self.usebookedhists(tempsamples, request, regionvariations)
 
     def sortsamples(self, samples):
         
@@ -1,10 +1,21 @@
-from ROOT import TFile, TTree, TH1D, gROOT
+from ROOT import TFile, TTree, TH1D, gROOT, RDataFrame, RDF
+from array import array
+import hashlib, os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import branches
 
 class sample:
 
+    # On-disk histogram cache, one file per sample in cachedir
+    usecache = True
+    cachedir = '.histcache'
+    cachehits = 0
+    cachemisses = 0
+
     def __init__(self, name, metadata):
 
         self.name = name
+        self.metadata = metadata
         self.sampletype = metadata['sampletype']
         self.filepath = metadata['filepath']
         self.treename = metadata['treename']
@@ -14,15 +25,99 @@ class sample:
         self.includeweights = 1.0 if metadata['includeweights'] == '' else metadata['includeweights']
         self.excludeweights = 1.0 if metadata['excludeweights'] == '' else metadata['includeweights']
         self.unitynorm = True if metadata['unitynorm'] == 'True' else False
+        self.hists = {}
+        # Alternate weight expressions {name: weights}, filled alongside the nominal weights
+        self.variations = metadata.get('variations', {})
+        self.varhists = {}
+
+    def __histkey__(self, variable, cuts, nominalweights, nbins, xmin, xmax, forcebins):
+
+        return (variable, cuts, nominalweights, nbins, xmin, xmax, tuple(forcebins))
+
+    def __variationrequests__(self, request, regionvariations):
+
+        # {name: request} with the nominal weights replaced, sample variations override region ones, none for data
+        if self.sampletype == 'data':
+            return {}
+        variations = dict(regionvariations)
+        variations.update(self.variations)
+        variable, cuts, nominalweights, nbins, xmin, xmax, forcebins = request
+        return {name: (variable, cuts, weights, nbins, xmin, xmax, forcebins) for name, weights in variations.items()}
+
+    def __cutstring__(self, cuts, nominalweights):
+
+        if self.sampletype != 'data':
+            return '({}) * ({}) * ({}) * ({})'.format(cuts, nominalweights, self.includeweights, self.scalefactor)
+        else:
+            return '({}) * ({}) * ({}) * ({})'.format(cuts, 1.0, self.includeweights, self.scalefactor)
+
+    def __cachekey__(self, variable, cuts, nominalweights, nbins, xmin, xmax, forcebins):
+
+        # Content address of a histogram: input file identity, tree, expression, full cut * weight string and binning
+        stat = os.stat(self.filepath)
+        content = (os.path.abspath(self.filepath), stat.st_size, stat.st_mtime_ns, self.treename, variable,
+                   self.__cutstring__(cuts, nominalweights), nbins, xmin, xmax, tuple(forcebins))
+        return 'h' + hashlib.sha1(repr(content).encode('utf-8')).hexdigest()
+
+    def __cachefile__(self):
+
+        pathhash = hashlib.sha1(os.path.abspath(self.filepath).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.cachedir, '{}_{}.root'.format(''.join(c if c.isalnum() else '_' for c in self.name), pathhash))
+
+    def __readcache__(self, cachekeys):
+
+        # Returns {cachekey: hist} for the keys found in the cache file
+        found = {}
+        if not self.usecache or not os.path.exists(self.__cachefile__()):
+            return found
+        cachefile = TFile(self.__cachefile__(), 'READ')
+        gROOT.cd()
+        for cachekey in cachekeys:
+            cachedhist = cachefile.Get(cachekey)
+            if cachedhist:
+                found[cachekey] = cachedhist.Clone()
+        cachefile.Close()
+        return found
+
+    def __writecache__(self, hists):
+
+        if not self.usecache or len(hists) == 0:
+            return
+        os.makedirs(self.cachedir, exist_ok=True)
+        cachefile = TFile(self.__cachefile__(), 'UPDATE')
+        for cachekey, hist in hists.items():
+            cachefile.WriteTObject(hist, cachekey, 'Overwrite')
+        cachefile.Close()
+        gROOT.cd()
+
+    def __style__(self, newhist):
+
+        if self.sampletype == 'data':
+            newhist.SetMarkerSize(1.5)
+        elif self.sampletype == 'background':
+            newhist.SetFillColor(self.colour)
+        elif self.sampletype == 'signal':
+            newhist.SetFillColor(0)
+            newhist.SetLineColor(self.colour)
+            newhist.SetLineWidth(2)
+            newhist.SetLineStyle(2)
 
     def __gethist__(self, variable, cuts, nominalweights, nbins, xmin, xmax, forcebins):
-        
+
+        cachekey = self.__cachekey__(variable, cuts, nominalweights, nbins, xmin, xmax, forcebins)
+        cached = self.__readcache__([cachekey])
+        if cachekey in cached:
+            sample.cachehits += 1
+            newhist = cached[cachekey]
+            self.__style__(newhist)
+            self.hist = newhist
+            return
+        sample.cachemisses += 1
+
         tempfile = TFile(self.filepath)
         temptree = tempfile.Get(self.treename)
-        if self.sampletype != 'data':
-            cutstring = '({}) * ({}) * ({}) * ({})'.format(cuts, nominalweights, self.includeweights, self.scalefactor)
-        else:
-            cutstring = '({}) * ({}) * ({}) * ({})'.format(cuts, 1.0, self.includeweights, self.scalefactor)
+        cutstring = self.__cutstring__(cuts, nominalweights)
+        branches.prune_tree(temptree, [variable, cutstring], self.name)
         temphistname = 'temphist_{}'.format(self.name)
         if len(forcebins) == 0:
             temphist = TH1D(temphistname,temphistname,nbins,xmin,xmax)
@@ -34,13 +129,68 @@ class sample:
         temptree.Draw('{}>>{}'.format(variable, temphistname),cutstring,'HIST')
         gROOT.cd()
         newhist = temphist.Clone()
-        if self.sampletype == 'data':
-            newhist.SetMarkerSize(1.5)
-        elif self.sampletype == 'background':
-            newhist.SetFillColor(self.colour)
-        elif self.sampletype == 'signal':
-            newhist.SetFillColor(0)
-            newhist.SetLineColor(self.colour)   
-            newhist.SetLineWidth(2)    
-            newhist.SetLineStyle(2)    
-        self.hist = newhist   
+        self.__writecache__({cachekey: newhist})
+        self.__style__(newhist)
+        self.hist = newhist
+
+    def __bookhists__(self, requests):
+
+        # Book every (variable, cuts, weights, binning) request on one RDataFrame so the tree is read once
+        # requests are the argument tuples of __gethist__, results are stored in self.hists by __histkey__
+        # Only book what is not already in the cache
+        cachekeys = {}
+        for request in requests:
+            key = self.__histkey__(*request)
+            if key not in self.hists:
+                cachekeys[key] = self.__cachekey__(*request)
+        cached = self.__readcache__(cachekeys.values())
+        for key, cachekey in cachekeys.items():
+            if cachekey in cached:
+                self.__style__(cached[cachekey])
+                self.hists[key] = cached[cachekey]
+        sample.cachehits += len(cached)
+
+        # One Filter node per region (distinct cuts), the weights and variables are only evaluated for events passing it
+        df = RDataFrame(self.treename, self.filepath)
+        regions = {}
+        columns = {}
+        results = {}
+        for request in requests:
+            key = self.__histkey__(*request)
+            if key in results or key in self.hists:
+                continue
+            variable, cuts, nominalweights, nbins, xmin, xmax, forcebins = request
+            if cuts not in regions:
+                regions[cuts] = df.Filter('({}) != 0'.format(cuts), 'region{}'.format(len(regions)))
+            # same cut * weight product as the TTree::Draw in __gethist__, shared between requests of a region
+            cutstring = self.__cutstring__(cuts, nominalweights)
+            if (cuts, cutstring) not in columns:
+                columns[(cuts, cutstring)] = 'plotweight{}'.format(len(columns))
+                regions[cuts] = regions[cuts].Define(columns[(cuts, cutstring)], cutstring)
+            if (cuts, variable) not in columns:
+                columns[(cuts, variable)] = 'plotvariable{}'.format(len(columns))
+                regions[cuts] = regions[cuts].Define(columns[(cuts, variable)], variable)
+            temphistname = 'temphist_{}'.format(self.name)
+            if len(forcebins) == 0:
+                model = RDF.TH1DModel(temphistname,temphistname,nbins,xmin,xmax)
+            else:
+                model = RDF.TH1DModel(temphistname,temphistname,len(forcebins) - 1,array('d',forcebins))
+            results[key] = regions[cuts].Histo1D(model, columns[(cuts, variable)], columns[(cuts, cutstring)])
+
+        sample.cachemisses += len(results)
+        if len(results) == 0:
+            return
+        # RDataFrame only reads the columns the booked expressions use
+        branches.rdf_columns(df, [expression for request in requests for expression in (request[0], self.__cutstring__(request[1], request[2]))], self.name)
+
+        # the first GetValue runs the event loop for all of them
+        gROOT.cd()
+        filled = {}
+        for key, result in results.items():
+            newhist = result.GetValue().Clone()
+            newhist.SetTitle(self.name)
+            filled[cachekeys[key]] = newhist
+            self.__style__(newhist)
+            self.hists[key] = newhist
+        self.__writecache__(filled)
+        print('{}: filled {} histograms in {} regions in one event loop'.format(self.name, len(results), len(regions)))
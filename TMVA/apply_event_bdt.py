@@ -2,16 +2,165 @@
 Description: Applies the weights of the trained event-level BDT classifier to unseeen data of unknown signal/background composition, and stores the output in a new branch in the input ROOT tree.
 Example running script
 python3 apply_event_bdt.py -t miniT -i /Users/ygao3/atlas_data/DarkPhoton/data/miniT/vbfskim/v02-00/frvz_vbf_500757.root -o output/ -w eventBDT_data/weights/TMVAClassification_BoostType=BDTG.weights.xml
+Modes (-m):
+    legacy  : event loop with tmva.Reader, checkpointed every -c entries so an interrupted job resumes where it stopped
+    rdf     : RDataFrame + TMVA experimental RReader, scores computed with -j threads (0 = all cores), the copy is
+              written single threaded in input entry order, not checkpointed
+    compare : run both and report the speedup
 '''
 __author__ = "Jack Gargan and Yanyan Gao"
 __doc__ = ""
 
 
 # IMPORTS ===========================================================================================================
+import ROOT
 from ROOT import TMVA as tmva
 from ROOT import TFile, TTree
 from array import array
-import argparse, os
+import argparse, os, sys, time
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import journal
+
+# define the BDT output branch, this does not need to be same as the method name
+branch_name = 'LJjet1_BDT'
+
+
+def copy_histograms(ip_tfile, op_tfile):
+    # copy all the histograms in the original file
+    histos = [key.GetName() for key in ip_tfile.GetListOfKeys() if key.GetClassName()[:2]=="TH"]
+    for x in histos:
+        op_tfile.WriteTObject(ip_tfile.Get(x))
+
+
+def apply_legacy(ip_tfile, ip_tree, op_path, bdt_weights_file, chunk_entries=1000000):
+    # Each chunk of chunk_entries is written to its own part file and recorded in op_path.journal.json,
+    # a restarted job skips the parts already there. The parts are merged into op_path at the end.
+    n_entries = ip_tree.GetEntries()
+    done = journal.Journal(op_path + ".journal.json", journal.job_key([ip_tfile.GetName(), bdt_weights_file], tree=ip_tree.GetName(), chunk_entries=chunk_entries))
+    progress = journal.Progress(n_entries, os.path.basename(op_path))
+
+    # begin TMVA reader setup
+    # These variables must match exactly what you used in the training
+    reader = tmva.Reader()
+
+    # Apply weights from train_LJjet1_BDT.py
+    local_LJjet1_eta    = array('f', [0]); reader.AddVariable("LJjet1_eta", local_LJjet1_eta)
+    # local_LJjet1_phi    = array('f', [0]); reader.AddVariable("LJjet1_phi", local_LJjet1_phi)
+    local_LJjet1_width    = array('f', [0]); reader.AddVariable("LJjet1_width", local_LJjet1_width)
+    local_LJjet1_EMfrac    = array('f', [0]); reader.AddVariable("LJjet1_EMfrac", local_LJjet1_EMfrac)
+    local_LJjet1_jvt    = array('f', [0]); reader.AddVariable("LJjet1_jvt", local_LJjet1_jvt)
+    local_LJjet1_m    = array('f', [0]); reader.AddVariable("LJjet1_m", local_LJjet1_m)
+    local_LJjet1_pt    = array('f', [0]); reader.AddVariable("LJjet1_pt", local_LJjet1_pt)
+	
+    reader.AddSpectator("scale1fb", array('f', [0]))	
+    # make sure event_BDT matches the name in the weight
+    reader.BookMVA("BDTG", bdt_weights_file)
+
+    bdt_response = array('f', [0])
+    parts = []
+    # an empty tree still gets one (empty) part so the output has the tree
+    for index, first in enumerate(range(0, max(n_entries, 1), chunk_entries)):
+        last = min(first + chunk_entries, n_entries)
+        parts.append(done.part_path(index, ".root"))
+        if done.done(index):
+            progress.skip(last - first)
+            continue
+
+        part_tfile = TFile(parts[-1], "recreate")
+        # clone the ip_tree to op_tree and make sure this tree is assigned to the part file
+        op_tree = ip_tree.CloneTree(0)
+        op_tree.SetDirectory(part_tfile)
+        bdt_branch = op_tree.Branch(branch_name,  bdt_response, branch_name+'/F')
+
+        for entry in range(first, last): 
+            ip_tree.GetEntry(entry)
+            op_tree.GetEntry(entry)
+            #if entry > 5: continue
+
+            # from train_LJjet1_BDT.py
+            local_LJjet1_eta[0]     = ip_tree.LJjet1_eta
+            # local_LJjet1_phi[0]     = ip_tree.LJjet1_phi
+            local_LJjet1_width[0]   = ip_tree.LJjet1_width
+            local_LJjet1_EMfrac[0]  = ip_tree.LJjet1_EMfrac
+            local_LJjet1_jvt[0]     = ip_tree.LJjet1_jvt
+            local_LJjet1_m[0]       = ip_tree.LJjet1_m
+            local_LJjet1_pt[0]      = ip_tree.LJjet1_pt
+            bdt_response[0] = reader.EvaluateMVA("BDTG")
+            #print(ip_tree.eventNumber, local_mjj[0], local_dphijj[0], local_jet1_pt[0], local_jet2_pt[0], bdt_response[0])	
+            op_tree.Fill()
+            if (entry + 1 - first) % 10000 == 0:
+                progress.update(10000)
+        progress.update((last - first) % 10000)
+        # the part is complete on disk before it goes in the journal
+        part_tfile.Write()
+        part_tfile.Close()
+        done.finish(index, entries=last - first)
+    progress.finish()
+
+    # join the parts in entry order, then copy all the histograms in the original file once
+    merger = ROOT.TFileMerger(False)
+    merger.OutputFile(op_path, "RECREATE")
+    for part in parts:
+        merger.AddFile(part)
+    if not merger.Merge():
+        raise Exception(f"Failed to merge the parts of {op_path} in {done.partdir}")
+    op_tfile = TFile(op_path, "update")
+    copy_histograms(ip_tfile, op_tfile)
+    op_tfile.Close()
+    journal.remove(done.path)
+
+
+def apply_rdf(ip_tfile, ip_tree, op_path, bdt_weights_file, n_threads):
+    # Scores are computed in a multithreaded loop, which visits the entries in any order, and put back in entry
+    # order by rdfentry_. The copy is then written by a single threaded Snapshot, which keeps the input order, so
+    # the output lines up entry by entry with the input tree and its friends (e.g. the miniT_AD scores)
+    ROOT.EnableImplicitMT(n_threads)
+    # RReader takes the variable list and order from the weights file
+    model = tmva.Experimental.RReader(bdt_weights_file)
+    variables = [str(v) for v in model.GetVariableNames()]
+
+    df = ROOT.RDataFrame(ip_tree)
+    # the reader only takes float inputs, cast in case the branches are stored as double
+    inputs = []
+    for i, variable in enumerate(variables):
+        df = df.Define(f"bdt_input_{i}", f"(float){variable}")
+        inputs.append(f"bdt_input_{i}")
+    df = df.Define("bdt_output", tmva.Experimental.Compute[len(variables), "float"](model), inputs)
+    df = df.Define(branch_name, "bdt_output[0]").Define("bdt_entry", "(ULong64_t)rdfentry_")
+    if hasattr(ROOT.RDF.Experimental, "AddProgressBar"):
+        # live events/s and ETA, ROOT 6.30 and later
+        ROOT.RDF.Experimental.AddProgressBar(df)
+    columns = df.AsNumpy(["bdt_entry", branch_name])
+    ROOT.DisableImplicitMT()
+    order = np.argsort(columns["bdt_entry"], kind="stable")
+    if not np.array_equal(columns["bdt_entry"][order], np.arange(ip_tree.GetEntries())):
+        raise Exception(f"The multithreaded loop over {ip_tfile.GetName()} did not visit every entry exactly once")
+    scores = np.ascontiguousarray(columns[branch_name][order], dtype=np.float32)
+
+    # keep every input branch and add the score, looked up by entry number in the single threaded loop
+    if not hasattr(ROOT, "apply_event_bdt_score"):
+        ROOT.gInterpreter.Declare("float apply_event_bdt_score(ULong64_t entry, ULong64_t scores) { return reinterpret_cast<const float*>(scores)[entry]; }")
+    df = ROOT.RDataFrame(ip_tree).Define(branch_name, f"apply_event_bdt_score(rdfentry_, {scores.ctypes.data}ULL)")
+    columns = [branch.GetName() for branch in ip_tree.GetListOfBranches()] + [branch_name]
+    df.Snapshot(ip_tree.GetName(), op_path, columns)
+
+    op_tfile = TFile(op_path, "update")
+    copy_histograms(ip_tfile, op_tfile)
+    op_tfile.Close()
+
+
+def run(mode, ip_tfile, ip_tree, op_path, args):
+    # run one application mode and return the events/s
+    start = time.time()
+    if mode == "legacy":
+        apply_legacy(ip_tfile, ip_tree, op_path, args.bdt_weights_file, args.chunk_entries)
+    else:
+        apply_rdf(ip_tfile, ip_tree, op_path, args.bdt_weights_file, args.n_threads)
+    elapsed = time.time() - start
+    rate = ip_tree.GetEntries() / elapsed
+    print(f"{mode}: {ip_tree.GetEntries()} events in {elapsed:.1f}s : {rate:.0f} events/s")
+    return rate
 
 
 def main():
@@ -21,6 +170,9 @@ def main():
     parser.add_argument('-i', action="store", dest="ip_file")
     parser.add_argument('-o', action="store", dest="op_dir")
     parser.add_argument('-w', action="store", dest="bdt_weights_file", default="")
+    parser.add_argument('-m', action="store", dest="mode", default="legacy", choices=["legacy", "rdf", "compare"])
+    parser.add_argument('-j', action="store", dest="n_threads", default=0, type=int)
+    parser.add_argument('-c', action="store", dest="chunk_entries", default=1000000, type=int, help="entries per checkpointed chunk in legacy mode")
 
     args = parser.parse_args()
     # get the filename from  the input file, last name element after "/"
@@ -35,62 +187,25 @@ def main():
     ip_tree = ip_tfile.Get(args.tree_name)
     # check if the ip_tree is valid 
     if not ip_tree:
-        print(args.treename + " does not exist, exitting") 
+        print(args.tree_name + " does not exist, exitting") 
         return
     # create new file    
     os.system('mkdir -p ' + args.op_dir)
-    op_tfile = TFile(args.op_dir +"/" + filename, "recreate")
-    # copy all the histograms in the original file
-    histos = [key.GetName() for key in ip_tfile.GetListOfKeys() if key.GetClassName()[:2]=="TH"]
-    for x in histos:
-        op_tfile.WriteTObject(ip_tfile.Get(x))
-    # clone the ip_tree to op_tree and make sure this tree is assigned to the op_tfile 
-    op_tree = ip_tree.CloneTree(0)
-    op_tree.SetDirectory(op_tfile)
+    op_path = args.op_dir +"/" + filename
 
-    # begin TMVA reader setup
-    # These variables must match exactly what you used in the training
-    reader = tmva.Reader()
+    if args.mode == "compare":
+        # legacy output goes to a legacy/ sub directory so both can be checked
+        os.system('mkdir -p ' + args.op_dir + "/legacy")
+        legacy_rate = run("legacy", ip_tfile, ip_tree, args.op_dir + "/legacy/" + filename, args)
+        rdf_rate = run("rdf", ip_tfile, ip_tree, op_path, args)
+        print(f"rdf speedup over legacy: {rdf_rate/legacy_rate:.1f}x")
+    else:
+        run(args.mode, ip_tfile, ip_tree, op_path, args)
 
-    # Apply weights from train_LJjet1_BDT.py
-    local_LJjet1_eta    = array('f', [0]); reader.AddVariable("LJjet1_eta", local_LJjet1_eta)
-    # local_LJjet1_phi    = array('f', [0]); reader.AddVariable("LJjet1_phi", local_LJjet1_phi)
-    local_LJjet1_width    = array('f', [0]); reader.AddVariable("LJjet1_width", local_LJjet1_width)
-    local_LJjet1_EMfrac    = array('f', [0]); reader.AddVariable("LJjet1_EMfrac", local_LJjet1_EMfrac)
-    local_LJjet1_jvt    = array('f', [0]); reader.AddVariable("LJjet1_jvt", local_LJjet1_jvt)
-    local_LJjet1_m    = array('f', [0]); reader.AddVariable("LJjet1_m", local_LJjet1_m)
-    local_LJjet1_pt    = array('f', [0]); reader.AddVariable("LJjet1_pt", local_LJjet1_pt)
-	
-    reader.AddSpectator("scale1fb", array('f', [0]))	
-    # make sure event_BDT matches the name in the weight
-    reader.BookMVA("BDTG", args.bdt_weights_file)
-
-    bdt_response = array('f', [0])
-    # define the BDT output branch, this does not need to be same as the method name
-    branch_name = 'LJjet1_BDT'
-    bdt_branch = op_tree.Branch(branch_name,  bdt_response, branch_name+'/F')
-
-    for entry in range(ip_tree.GetEntries()): 
-        ip_tree.GetEntry(entry)
-        op_tree.GetEntry(entry)
-        #if entry > 5: continue
-
-        # from train_LJjet1_BDT.py
-        local_LJjet1_eta[0]     = ip_tree.LJjet1_eta
-        # local_LJjet1_phi[0]     = ip_tree.LJjet1_phi
-        local_LJjet1_width[0]   = ip_tree.LJjet1_width
-        local_LJjet1_EMfrac[0]  = ip_tree.LJjet1_EMfrac
-        local_LJjet1_jvt[0]     = ip_tree.LJjet1_jvt
-        local_LJjet1_m[0]       = ip_tree.LJjet1_m
-        local_LJjet1_pt[0]      = ip_tree.LJjet1_pt
-        bdt_response[0] = reader.EvaluateMVA("BDTG")
-        #print(ip_tree.eventNumber, local_mjj[0], local_dphijj[0], local_jet1_pt[0], local_jet2_pt[0], bdt_response[0])	
-        op_tree.Fill()
     # make sure you close each file after it is open
     ip_tfile.Close()	
-    # write the output file
-    op_tfile.Write()
-    op_tfile.Close()
+
+
 
 
 if __name__ == '__main__':
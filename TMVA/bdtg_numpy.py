@@ -0,0 +1,146 @@
+'''
+Description: NumPy evaluator for the TMVA BDTG weights file written by train_LJjet1_BDT.py, no ROOT needed.
+    The forest is parsed once into flat arrays (feature index, cut, child indices, leaf response) and
+    evaluated on whole column batches, matching reader.EvaluateMVA("BDTG") to float precision
+    (tests/test_bdtg_numpy.py checks a hand-written forest and, with ROOT, a TMVA-trained one against EvaluateMVA).
+Example running script, writes the LJjet1_BDT score to a friend file outputDir/<name>_BDT.root (tree miniT_BDT)
+python3 bdtg_numpy.py -t miniT -i frvz_vbf_500757.root -o output/ -w LJjet1_BDT/weights/TMVAClassification_BoostType=BDTG.weights.xml -j 8
+Or from python
+    forest = BDTGForest.from_xml(weights_file)
+    scores = forest.evaluate(np.column_stack([arrays[v] for v in forest.variables]))
+'''
+
+# IMPORTS ===========================================================================================================
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import argparse, os, time
+
+
+class BDTGForest:
+
+    def __init__(self, variables, feature, cut, cut_type, left, right, response, roots, max_depth):
+        # input variables in the order of the feature columns
+        self.variables = variables
+        # one entry per node of every tree, leaves point to themselves
+        self.feature   = feature
+        self.cut       = cut
+        self.cut_type  = cut_type
+        self.left      = left
+        self.right     = right
+        self.response  = response
+        # index of the first node of each tree
+        self.roots     = roots
+        self.max_depth = max_depth
+
+    @classmethod
+    def from_xml(cls, weights_file):
+        root = ET.parse(weights_file).getroot()
+
+        boost_type = [option.text for option in root.iter("Option") if option.get("name") == "BoostType"]
+        if boost_type and boost_type[0] != "Grad":
+            raise NotImplementedError(f"Only BoostType=Grad is supported, {weights_file} uses {boost_type[0]}")
+        transformations = root.find("Transformations")
+        if transformations is not None and int(transformations.get("NTransformations", "0")) > 0:
+            raise NotImplementedError(f"Input variable transformations in {weights_file} are not supported")
+
+        variables = [v.get("Expression") for v in sorted(root.find("Variables"), key=lambda v: int(v.get("VarIndex")))]
+
+        feature, cut, cut_type, left, right, response, roots = [], [], [], [], [], [], []
+        max_depth = 0
+
+        def add_node(node, depth):
+            nonlocal max_depth
+            max_depth = max(max_depth, depth)
+            if int(node.get("NCoef", "0")) != 0:
+                raise NotImplementedError(f"Fisher cuts in {weights_file} are not supported")
+            index = len(feature)
+            # leaves have IVar=-1, any valid column will do as they point back to themselves
+            feature.append(max(int(node.get("IVar")), 0))
+            cut.append(float(node.get("Cut")))
+            cut_type.append(int(node.get("cType", "1")) == 1)
+            response.append(float(node.get("res")))
+            left.append(index)
+            right.append(index)
+            # nType 0 is an intermediate node, +-1 a signal/background leaf
+            if int(node.get("nType")) == 0:
+                children = {child.get("pos"): child for child in node.findall("Node")}
+                left[index]  = add_node(children["l"], depth + 1)
+                right[index] = add_node(children["r"], depth + 1)
+            return index
+
+        for tree in root.find("Weights").iter("BinaryTree"):
+            roots.append(add_node(tree.find("Node"), 0))
+
+        # TMVA stores cuts and responses as Float_t, keep the same precision
+        return cls(variables, np.array(feature, dtype=np.int32), np.array(cut, dtype=np.float32), np.array(cut_type),
+                   np.array(left, dtype=np.int32), np.array(right, dtype=np.int32),
+                   np.array(response, dtype=np.float32).astype(np.float64), np.array(roots, dtype=np.int32), max_depth)
+
+    def evaluate_batch(self, x):
+        # walk all trees at once, one level per step - finished trees stay on their leaf
+        nodes = np.repeat(self.roots[np.newaxis, :], len(x), axis=0)
+        rows  = np.arange(len(x))[:, np.newaxis]
+        for depth in range(self.max_depth):
+            # same decision as TMVA::DecisionTreeNode::GoesRight
+            goes_right = (x[rows, self.feature[nodes]] >= self.cut[nodes]) == self.cut_type[nodes]
+            nodes = np.where(goes_right, self.right[nodes], self.left[nodes])
+        total = self.response[nodes].sum(axis=1)
+        return 2.0/(1.0+np.exp(-2.0*total))-1
+
+    def evaluate(self, x, batch_size=4096, n_threads=1):
+        """
+        BDTG response for a (nEvents, nVariables) array with columns in the order of self.variables
+        """
+        x = np.asarray(x, dtype=np.float32)
+        output = np.empty(len(x))
+
+        def run(first):
+            output[first:first+batch_size] = self.evaluate_batch(x[first:first+batch_size])
+
+        if n_threads > 1:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                list(pool.map(run, range(0, len(x), batch_size)))
+        else:
+            for first in range(0, len(x), batch_size):
+                run(first)
+        return output
+
+
+def main():
+    import uproot
+
+    parser = argparse.ArgumentParser(description='NumPy BDTG application script')
+    parser.add_argument('-t', action="store", dest="tree_name", default="miniT")
+    parser.add_argument('-i', action="store", dest="ip_file")
+    parser.add_argument('-o', action="store", dest="op_dir")
+    parser.add_argument('-w', action="store", dest="bdt_weights_file", default="")
+    parser.add_argument('-j', action="store", dest="n_threads", default=os.cpu_count(), type=int)
+    parser.add_argument('-s', action="store", dest="step_size", default="100 MB")
+
+    args = parser.parse_args()
+    forest = BDTGForest.from_xml(args.bdt_weights_file)
+
+    os.makedirs(args.op_dir, exist_ok=True)
+    base_name = os.path.basename(args.ip_file).split('.')[0]
+    op_file = os.path.join(args.op_dir, f"{base_name}_BDT.root")
+    friend_tree = f"{args.tree_name}_BDT"
+
+    start = time.time()
+    n_events = 0
+    with uproot.recreate(op_file) as op:
+        for chunk in uproot.iterate({args.ip_file: args.tree_name}, forest.variables, step_size=args.step_size, library="np"):
+            scores = forest.evaluate(np.column_stack([chunk[v] for v in forest.variables]), n_threads=args.n_threads)
+            branches = {"LJjet1_BDT": scores.astype(np.float32)}
+            if n_events == 0:
+                op[friend_tree] = branches
+            else:
+                op[friend_tree].extend(branches)
+            n_events += len(scores)
+    elapsed = time.time() - start
+    print(f"numpy: {n_events} events in {elapsed:.1f}s : {n_events/elapsed:.0f} events/s")
+    print(f"Scores written to {op_file}, use tree.AddFriend(\"{friend_tree}\", \"{op_file}\")")
+
+
+if __name__ == '__main__':
+    main()
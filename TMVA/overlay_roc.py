@@ -1,4 +1,5 @@
 import uproot
+import numpy as np
 import matplotlib.pyplot as plt
 
 # Define file and object names ---
@@ -12,13 +13,24 @@ curve_name1 = 'LJjet1_BDT'
 #curve_name2 = 'LJjet1_DPJtagger'
 
 
+def load_curve(file_path, curve_name):
+    # ROC curve as (signal efficiency, background rejection) from a TGraph in a .root file
+    # or from the unbinned .npz written by roc_comparison.py -u
+    if file_path.endswith('.npz'):
+        with np.load(file_path) as curves:
+            if f'{curve_name}_eff_sig' not in curves:
+                raise KeyError(curve_name)
+            print(f"{file_path} {curve_name}: AUC = {float(curves[f'{curve_name}_auc']):.4f}")
+            return curves[f'{curve_name}_eff_sig'], curves[f'{curve_name}_rej_bkg']
+    with uproot.open(file_path) as f:
+        return f[curve_name].values()
+
+
 try:
-    # Uproot reads TGraphs into objects that provide x and y values
-    with uproot.open(file1_path) as file1:
-        x1, y1 = file1[curve_name1].values()
+    # Uproot reads TGraphs into objects that provide x and y values, .npz files hold the unbinned curves
+    x1, y1 = load_curve(file1_path, curve_name1)
 
-    with uproot.open(file2_path) as file2:
-        x2, y2 = file2[curve_name1].values()
+    x2, y2 = load_curve(file2_path, curve_name1)
 
     # with uproot.open(file3_path) as file3:
       #  x3, y3 = file3[curve_name1].values()
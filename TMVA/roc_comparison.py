@@ -1,78 +1,109 @@
 '''
     This script saves and compares ROC curves 
+    Every variable is booked on one RDataFrame per sample, so each file is read once
     Run by
         python3 roc_comparison.py  -o roc_output/
+    The AD mse/isTest friend trees default to <sample name>_AD.root in the working directory, as written by
+    train_LJjet1_AD_v1.py. Other friend files are given with
+        python3 roc_comparison.py  -o roc_output/ --sig-friend miniT_AD:frvz_vbf_500764_AD.root --bkg-friend miniT_AD:wjets_strong_sh227_AD.root
+    -u adds the exact unbinned weighted curves, AUC and working points (roc_curve_64.npz, readable by overlay_roc.py)
 '''
 __author__ = "Yanyan Gao"
 __doc__ = ""
 
 # IMPORTS ===========================================================================================================
 import numpy as np
+import ROOT
 from ROOT import TMVA as tmva
-from ROOT import TFile, TTree, TH1F, TGraph, TCanvas, TLegend, kBlue, kRed, kBlack, kGreen
+from ROOT import TFile, TTree, TChain, TH1F, TGraph, TCanvas, TLegend, RDataFrame, kBlue, kRed, kBlack, kGreen
 from array import array
-import argparse, os
+import argparse, os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import branches
+from selections import PRESELECTIONS
+from roc_unbinned import unbinned_roc, save_unbinned
 
 sig_filename = "/Users/sirawitsae/Desktop/project/hep-python/TMVA/output_AD/applyweight_64/frvz_vbf_500764.root"
 bkg_filename = "/Users/sirawitsae/Desktop/project/hep-python/TMVA/output_AD/applyweight_64/wjets_strong_sh227.root"
 
-def get_roc(x, y, sig_filename, bkg_filename, treename, cut_string, weight_string, variable_name, nBins, xMin, xMax, left_cut=False):
-
-    full_cut_string = '(' + weight_string + ')*(' + cut_string + ')' 
-    # Process signal
-    sig_tfile = TFile.Open(sig_filename, "READ")
-    sig_ttree = sig_tfile.Get(treename)
-    print('Signal has ' + str(sig_ttree.GetEntries()) + ' entries')
-
-    h_sig_name = 'h_sig_' + variable_name
-    if '(' in variable_name:
-        h_sig_name = h_sig_name.replace('(', '_')
-    if ')' in variable_name:
-        h_sig_name = h_sig_name.replace(')', '')
-    h_sig = TH1F(h_sig_name, h_sig_name, nBins, xMin, xMax)
-    h_sig.Sumw2()
-    h_sig.SetXTitle(variable_name)
- 
-    draw_string = variable_name + '>>' + h_sig_name
-    print(draw_string, full_cut_string)
-    sig_ttree.Draw(draw_string, full_cut_string)
-    #print(h_sig.Integral())
-
-    for bin in range(nBins):
-        eff = h_sig.Integral(bin, nBins+1) / h_sig.Integral(0, nBins+1) if h_sig.Integral(0, nBins+1) > 0 else 0
-        if left_cut:
-            eff = h_sig.Integral(0, bin) / h_sig.Integral(0, nBins+1) if h_sig.Integral(0, nBins+1) > 0 else 0
-        #print(bin, h_sig.GetBinContent(bin), eff)
-        x.append(eff)
-    sig_tfile.Close()
-
-    # Process background 
-    bkg_tfile = TFile.Open(bkg_filename, "READ")
-    bkg_ttree = bkg_tfile.Get(treename)
-    print('Background has ' + str(bkg_ttree.GetEntries()) + ' entries')
-
-    h_bkg_name = 'h_bkg_' + variable_name
-    if '(' in variable_name:
-        h_bkg_name = h_bkg_name.replace('(', '_')
-    if ')' in variable_name:
-        h_bkg_name = h_bkg_name.replace(')', '')
- 
-    h_bkg = TH1F(h_bkg_name, h_bkg_name, nBins, xMin, xMax)
-    h_bkg.Sumw2()
-    h_bkg.SetXTitle(variable_name)
- 
-    draw_string = variable_name + '>>' + h_bkg_name
-    #print(draw_string, full_cut_string)
-    bkg_ttree.Draw(draw_string, full_cut_string)
-    #print(h_bkg.Integral())
-
-    for bin in range(nBins):
-        eff = h_bkg.Integral(bin, nBins+1) / h_bkg.Integral(0, nBins+1) if h_bkg.Integral(0, nBins+1) > 0 else 0
-        if left_cut:
-            eff = h_bkg.Integral(0, bin) / h_bkg.Integral(0, nBins+1) if h_bkg.Integral(0, nBins+1) > 0 else 0
-        #print(bin, h_bkg.GetBinContent(bin), eff)
-        y.append(1-eff)
-    bkg_tfile.Close()
+def bin_contents(hist):
+    # bin contents including under/overflow as a numpy view, no per-bin python calls
+    return np.frombuffer(hist.GetArray(), dtype=np.float64, count=hist.GetNbinsX()+2)
+
+def get_efficiencies(hist, left_cut=False):
+    # efficiency of a cut at the lower edge of each bin from a single cumulative sum
+    contents = bin_contents(hist)
+    nBins = hist.GetNbinsX()
+    total = contents.sum()
+    if total <= 0:
+        return np.zeros(nBins)
+    if left_cut:
+        # Integral(0, bin)
+        return np.cumsum(contents)[:nBins] / total
+    # Integral(bin, nBins+1)
+    return np.cumsum(contents[::-1])[::-1][:nBins] / total
+
+def book_rocs(filename, treename, cut_string, weight_string, variables, label, friends=[], unbinned=False):
+    """
+    Book the histograms of every variable on one lazy RDataFrame - the file is read once for all of them
+    friends: list of (tree name, file name) friend trees, e.g. the AD scores miniT_AD
+    unbinned: also collect the raw scores and weights in the same event loop
+    """
+    chain = TChain(treename)
+    chain.Add(filename)
+    for friend_tree, friend_file in friends:
+        chain.AddFriend(friend_tree, friend_file)
+    print(filename + ' has ' + str(chain.GetEntries()) + ' entries')
+
+    df = RDataFrame(chain).Filter(cut_string).Define('roc_weight', weight_string)
+    hists, scores = {}, {}
+    for i, var in enumerate(variables):
+        # extra per-variable selection, e.g. isTest==1 for mse
+        node = df.Filter(var['cut']) if var['cut'] else df
+        node = node.Define('roc_var_' + str(i), var['name'])
+        h_name = 'h_' + label + '_' + var['name']
+        h_name = h_name.replace('(', '_').replace(')', '')
+        hists[var['name']] = node.Histo1D((h_name, h_name, var['nbins'], var['xmin'], var['xmax']), 'roc_var_' + str(i), 'roc_weight')
+        if unbinned:
+            scores[var['name']] = node.AsNumpy(['roc_var_' + str(i), 'roc_weight'], lazy=True)
+    branches.rdf_columns(df, [cut_string, weight_string] + [var['name'] for var in variables] + [var['cut'] for var in variables], label)
+    # keep the chain alive until the event loop has run
+    return chain, hists, scores
+
+def get_rocs(sig_filename, bkg_filename, treename, cut_string, weight_string, variables, sig_friends=[], bkg_friends=[], unbinned=False):
+    """
+    ROC curves (signal efficiency, background rejection) for every variable, one event loop per sample
+    With unbinned=True also returns the exact unbinned_roc results per variable
+    """
+    sig_chain, sig_hists, sig_scores = book_rocs(sig_filename, treename, cut_string, weight_string, variables, 'sig', sig_friends, unbinned)
+    bkg_chain, bkg_hists, bkg_scores = book_rocs(bkg_filename, treename, cut_string, weight_string, variables, 'bkg', bkg_friends, unbinned)
+    # run both event loops together
+    ROOT.RDF.RunGraphs(list(sig_hists.values()) + list(bkg_hists.values()))
+
+    rocs = {}
+    for var in variables:
+        x = array('d', get_efficiencies(sig_hists[var['name']].GetValue(), var['left_cut']))
+        y = array('d', 1 - get_efficiencies(bkg_hists[var['name']].GetValue(), var['left_cut']))
+        rocs[var['name']] = (x, y)
+    if not unbinned:
+        return rocs
+
+    exact_rocs = {}
+    for i, var in enumerate(variables):
+        sig = sig_scores[var['name']].GetValue()
+        bkg = bkg_scores[var['name']].GetValue()
+        column = 'roc_var_' + str(i)
+        exact_rocs[var['name']] = unbinned_roc(sig[column], sig['roc_weight'], bkg[column], bkg['roc_weight'], var['left_cut'])
+    return rocs, exact_rocs
+
+def parse_friends(friends):
+    # "tree:file" strings from the command line
+    return [tuple(friend.split(':', 1)) for friend in friends]
+
+def default_friend(filename, treename):
+    # the friend file train_LJjet1_AD_v1.py writes for a sample: <name>_AD.root with tree <tree>_AD, in the working directory
+    base_name = os.path.basename(filename).split('.')[0]
+    return treename + '_AD:' + base_name + '_AD.root'
 
 def setstyle(gr, name, color):
     gr.SetTitle('ROC curve')
@@ -94,54 +125,59 @@ def main():
 
     parser = argparse.ArgumentParser(description='ROC curve analysis script')
     parser.add_argument('-o', action="store", dest="op_dir", default="output")
+    # friend trees holding extra scores, e.g. --sig-friend miniT_AD:frvz_vbf_500764_AD.root
+    parser.add_argument('--sig-friend', action="append", dest="sig_friends", default=[])
+    parser.add_argument('--bkg-friend', action="append", dest="bkg_friends", default=[])
+    # exact unbinned curves, AUC and working points, saved to roc_curve_64.npz
+    parser.add_argument('-u', action="store_true", dest="unbinned")
 
     args = parser.parse_args()
 
     treename = "miniT"
+    # mse and isTest live in the AD friend trees, fail here rather than inside RDataFrame if one is missing
+    sig_friends = parse_friends(args.sig_friends or [default_friend(sig_filename, treename)])
+    bkg_friends = parse_friends(args.bkg_friends or [default_friend(bkg_filename, treename)])
+    for flag, friends in (('--sig-friend', sig_friends), ('--bkg-friend', bkg_friends)):
+        for friend_tree, friend_file in friends:
+            if not os.path.exists(friend_file):
+                parser.error(f"friend file {friend_file} with the mse/isTest scores not found, pass it with {flag} {friend_tree}:<file>")
     weight_string = 'scale1fb'
-    base_cut_string = 'nLJjets20>0&&LJjet1_pt>20e3&&LJjet1_gapRatio>0.9&&LJjet1_EMfrac<0.4'
+    base_cut_string = PRESELECTIONS['ljet']
 
-    # roc curve for two variables
+    # roc curves for all variables, booked together 
     nbins = 200
-    var1 = 'LJjet1_DPJtagger';  x1_min = 0;     x1_max = 1
-    x_var1, y_var1 = array( 'd' ), array( 'd' )
-    get_roc(x_var1, y_var1, sig_filename, bkg_filename, treename, base_cut_string, weight_string, var1, nbins, x1_min, x1_max) 
-    
-    var2 = 'LJjet1_BDT';  x2_min = -1;     x2_max = 1
-    x_var2, y_var2 = array( 'd' ), array( 'd' )
-    get_roc(x_var2, y_var2, sig_filename, bkg_filename, treename, base_cut_string, weight_string, var2, nbins, x2_min, x2_max)
-    
-    # --- MODIFICATION: Add the isTest==1 cut for the mse variable ---
-    var3 = 'mse';  x3_min = 0;     x3_max = 12.
-    cut_string_mse = base_cut_string + '&&isTest==1' # Append the new condition
-    x_var3, y_var3 = array( 'd' ), array( 'd' )
-    get_roc(x_var3, y_var3, sig_filename, bkg_filename, treename, cut_string_mse, weight_string, var3, nbins, x3_min, x3_max)
-
+    variables = [
+        {'name': 'LJjet1_DPJtagger', 'nbins': nbins, 'xmin': 0,  'xmax': 1,   'cut': '', 'left_cut': False, 'colour': kBlack},
+        {'name': 'LJjet1_BDT',       'nbins': nbins, 'xmin': -1, 'xmax': 1,   'cut': '', 'left_cut': False, 'colour': kRed},
+        # --- MODIFICATION: Add the isTest==1 cut for the mse variable ---
+        {'name': 'mse',              'nbins': nbins, 'xmin': 0,  'xmax': 12., 'cut': 'isTest==1', 'left_cut': False, 'colour': kBlue},
+    ]
+    rocs = get_rocs(sig_filename, bkg_filename, treename, base_cut_string, weight_string, variables, sig_friends, bkg_friends, args.unbinned)
 
     # create new file to store the ROC curves 
     os.system('mkdir -p ' + args.op_dir)
-    op_tfile = TFile(args.op_dir +"/roc_curve_64.root", "recreate")
 
-    # create graph for LJjet1 CNN 
-    gr_var1 = TGraph( len(x_var1), x_var1, y_var1 )
-    setstyle(gr_var1, var1,  kBlack)
-    gr_var1.Write()
-
-    # create graph for BDT
-    gr_var2 = TGraph( len(x_var2), x_var2, y_var2 )
-    setstyle(gr_var2, var2,  kRed)
-    gr_var2.Write()
+    if args.unbinned:
+        rocs, exact_rocs = rocs
+        save_unbinned(exact_rocs, args.op_dir + "/roc_curve_64.npz")
+        print('{:<20} {:>8} '.format('variable', 'AUC') + ' '.join('effS@rej{:<6}'.format(r) for r in exact_rocs[variables[0]['name']]['wp_rejection']))
+        for name, roc in exact_rocs.items():
+            print('{:<20} {:>8.4f} '.format(name, roc['auc']) + ' '.join('{:>14.4f}'.format(eff) for eff in roc['wp_eff_sig']))
+    op_tfile = TFile(args.op_dir +"/roc_curve_64.root", "recreate")
 
-    # create graph for mse
-    gr_var3 = TGraph( len(x_var3), x_var3, y_var3 )
-    setstyle(gr_var3, var3,  kBlue)
-    gr_var3.Write()
+    # create one graph per variable
+    graphs = []
+    for var in variables:
+        x, y = rocs[var['name']]
+        gr = TGraph( len(x), x, y )
+        setstyle(gr, var['name'], var['colour'])
+        gr.Write()
+        graphs.append(gr)
 
     # make overlay plots 
     canvas = TCanvas( 'canvas', 'ROC curve')
-    gr_var2.Draw()
-    gr_var1.Draw("same")
-    gr_var3.Draw("same")
+    for i, gr in enumerate(graphs):
+        gr.Draw("" if i == 0 else "same")
 
     # define the location of the legend
     x0, x1, y0, y1 = 0.20, 0.60, 0.30, 0.60
@@ -152,9 +188,8 @@ def main():
     legend.SetFillColor(0)
     legend.SetFillStyle(0)
     legend.SetLineColor(0)  
-    legend.AddEntry(gr_var3, var3, 'l')
-    legend.AddEntry(gr_var2, var2,  'l')
-    legend.AddEntry(gr_var1, var1, 'l')
+    for var, gr in reversed(list(zip(variables, graphs))):
+        legend.AddEntry(gr, var['name'], 'l')
     legend.Draw()
 
     canvas.SaveAs(args.op_dir + '/roc_curve_64.png')
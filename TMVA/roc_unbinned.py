@@ -0,0 +1,58 @@
+'''
+Description: Exact weighted ROC curves from raw scores and weights, no ROOT needed.
+    Used by roc_comparison.py -u, the curves are saved to an npz read by overlay_roc.py.
+Example
+    roc = unbinned_roc(sig_scores, sig_weights, bkg_scores, bkg_weights)
+    print(roc['auc'], roc['wp_eff_sig'])
+'''
+
+# IMPORTS ===========================================================================================================
+import numpy as np
+
+
+def unbinned_roc(sig_scores, sig_weights, bkg_scores, bkg_weights, left_cut=False, rejections=(0.9, 0.95, 0.99, 0.999)):
+    """
+    Exact weighted ROC curve from one sort of all scores, no binning or range needed
+    Returns signal efficiency, background rejection and threshold for every distinct cut value,
+    the trapezoidal AUC and the signal efficiency / threshold at fixed background rejection working points
+    """
+    scores  = np.concatenate([sig_scores, bkg_scores]).astype(np.float64)
+    weights = np.concatenate([sig_weights, bkg_weights]).astype(np.float64)
+    is_sig  = np.concatenate([np.ones(len(sig_scores), dtype=bool), np.zeros(len(bkg_scores), dtype=bool)])
+    # +-inf scores sort to the ends like any other cut value, only nan has no place on the curve
+    keep = ~np.isnan(scores)
+    for name, dropped in (('signal', ~keep & is_sig), ('background', ~keep & ~is_sig)):
+        if dropped.any():
+            print(f"unbinned_roc: dropping {np.count_nonzero(dropped)} {name} entries with a nan score (total weight {weights[dropped].sum():g})")
+    scores, weights, is_sig = scores[keep], weights[keep], is_sig[keep]
+    # efficiencies are fractions of these totals, they have to exist and be positive
+    for name, total in (('signal', weights[is_sig].sum()), ('background', weights[~is_sig].sum())):
+        if not total > 0:
+            raise ValueError(f"unbinned_roc: the {name} sample has no entries with a score and positive total weight")
+
+    # cuts are score >= threshold (score <= threshold for left_cut): sort so the tightest cut comes first
+    order  = np.argsort(scores if left_cut else -scores, kind='stable')
+    scores = scores[order]
+    cum_sig = np.cumsum(np.where(is_sig[order], weights[order], 0.))
+    cum_bkg = np.cumsum(np.where(is_sig[order], 0., weights[order]))
+    # a cut can't split equal scores, keep the last entry of each group (not np.diff, inf - inf is nan)
+    last = np.append(np.nonzero(scores[1:] != scores[:-1])[0], len(scores)-1)
+
+    eff_sig = np.append(0., cum_sig[last] / cum_sig[-1])
+    rej_bkg = 1 - np.append(0., cum_bkg[last] / cum_bkg[-1])
+    thresholds = np.append(-np.inf if left_cut else np.inf, scores[last])
+    auc = np.sum(np.diff(eff_sig) * (rej_bkg[1:] + rej_bkg[:-1]) / 2)
+
+    # loosest cut still reaching each background rejection
+    wp_eff_sig, wp_threshold = [], []
+    for rejection in rejections:
+        passing = np.nonzero(rej_bkg >= rejection)[0]
+        wp_eff_sig.append(eff_sig[passing[-1]] if len(passing) else 0.)
+        wp_threshold.append(thresholds[passing[-1]] if len(passing) else np.nan)
+
+    return {'eff_sig': eff_sig, 'rej_bkg': rej_bkg, 'thresholds': thresholds, 'auc': auc,
+            'wp_rejection': np.array(rejections), 'wp_eff_sig': np.array(wp_eff_sig), 'wp_threshold': np.array(wp_threshold)}
+
+def save_unbinned(rocs, filename):
+    # one npz with <variable>_<quantity> arrays, read by overlay_roc.py
+    np.savez_compressed(filename, **{name + '_' + key: value for name, roc in rocs.items() for key, value in roc.items()})
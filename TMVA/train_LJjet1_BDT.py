@@ -7,6 +7,9 @@
 # IMPORTS ===========================================================================================================
 from ROOT import TMVA as tmva
 from ROOT import TFile, TCut
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from selections import PRESELECTIONS
 
 # Define function to get and return data ROOT trees ----------------------------------------------------------------
 def get_trees(sig_filepath, bgd_filepath, tree_name):
@@ -52,8 +55,8 @@ def create_bdt(sigTree, bgdTree, out_file):
     #bgdCut = TCut("MET>150e3")
     # YY: Current code does not work if we are to have different cuts for signal and background
     #sigCut = TCut("nLJjets20>0&&LJjet1_pt>20e3&&LJjet1_gapRatio>0.9&&LJjet1_DPtruthMatched > 0")
-    sigCut = TCut("nLJjets20>0&&LJjet1_pt>20e3&&LJjet1_gapRatio>0.9&&LJjet1_EMfrac<0.4")
-    bgdCut = TCut("nLJjets20>0&&LJjet1_pt>20e3&&LJjet1_gapRatio>0.9&&LJjet1_EMfrac<0.4")
+    sigCut = TCut(PRESELECTIONS["ljet"])
+    bgdCut = TCut(PRESELECTIONS["ljet"])
     #sigCut = TCut("1")
     #bgdCut = TCut("1")
 
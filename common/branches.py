@@ -0,0 +1,58 @@
+'''
+Description: Work out which branches of a tree are needed from the variable, cut and weight expressions that are
+    evaluated on it, and read only those. Every identifier in the expressions that is also a branch name is kept,
+    so TTreeFormula/RDataFrame strings such as "(LJjet1_pt>20e3) * (scale1fb*intLumi)" and plain branch names both work.
+Example, in a TTree loop
+    tree = myfile.Get("miniT")
+    branches.prune_tree(tree, ["truthPdgId", "truthPt", "LJjet1_pt*0.001"], "frvz_vbf_500757")
+or for a TTree::Draw / RDataFrame selection
+    branches.prune_tree(tree, [variable, cutstring])
+'''
+
+# IMPORTS ===========================================================================================================
+import re
+
+# names not preceded by a digit or a dot, so the exponent of 20e3 and members like v.size() are skipped
+IDENTIFIER = re.compile(r'(?<![A-Za-z0-9_.])[A-Za-z_][A-Za-z0-9_]*')
+STRING_LITERAL = re.compile(r'"[^"]*"|\'[^\']*\'')
+
+
+def referenced(expressions):
+    # every identifier appearing in the expressions, string literals removed
+    names = set()
+    for expression in expressions:
+        names.update(IDENTIFIER.findall(STRING_LITERAL.sub('', str(expression))))
+    return names
+
+
+def needed_branches(available, expressions):
+    # branches out of available that the expressions read, in a stable order
+    return sorted(set(available) & referenced(expressions))
+
+
+def report(label, needed, n_available):
+    print(f"{label}: reading {len(needed)} of {n_available} branches: {', '.join(needed)}")
+
+
+def prune_tree(tree, expressions, label=''):
+    """
+    Switch off every branch of tree that the expressions do not read, returns the list of branches kept
+    """
+    available = [branch.GetName() for branch in tree.GetListOfBranches()]
+    needed = needed_branches(available, expressions)
+    tree.SetBranchStatus('*', 0)
+    for name in needed:
+        tree.SetBranchStatus(name, 1)
+    report(label or tree.GetName(), needed, len(available))
+    return needed
+
+
+def rdf_columns(df, expressions, label=''):
+    """
+    Columns of an RDataFrame that the expressions read. RDataFrame already only reads the columns used by its
+    actions, this reports them so the selection can be checked
+    """
+    available = [str(column) for column in df.GetColumnNames()]
+    needed = needed_branches(available, expressions)
+    report(label, needed, len(available))
+    return needed
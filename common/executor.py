@@ -0,0 +1,179 @@
+'''
+Description: Chunked map-reduce over the entries of one or more trees.
+    The inputs are split into entry ranges. A user function is run on the arrays of every range in a pool of
+    worker processes and the returned results are merged. A result can be a histogram, a TEfficiency, a
+    histograms.FineHistogram, a number or numpy array, or any dict/list/tuple of these. Results are combined by a
+    fixed binary tree over the chunk order, whatever order the workers finish in, so reruns, any number of workers
+    and resumed runs give bit for bit the same output for the same entries_per_chunk.
+    With unit weights the bin contents and entries are exact integers and also match the serial loop bit for bit.
+    Weighted sums and the mean/RMS statistics are added in a different order than in the serial loop (or with a
+    different entries_per_chunk), so against those they can differ in the last bit.
+    The chunk function must be defined at module level (it is pickled to the workers) and should book its own
+    histograms, e.g. eff.efficiency_chunk.
+    With a journal path every chunk result is saved as it arrives (see journal.py). A restarted run with the same
+    inputs and settings only reads the missing chunks, and the output is the same as for an uninterrupted run.
+Example
+    def efficiency_chunk(arrays):
+        hists = book_histograms()
+        fill_efficiency(arrays, hists)
+        return hists
+
+    hists = executor.run(efficiency_chunk, [input_file_path], eff_branches, n_workers=8, journal="eff.journal.json")
+'''
+
+# IMPORTS ===========================================================================================================
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import os, sys, time
+
+import journal as journals
+
+
+def entry_ranges(inputs, tree="miniT", entries_per_chunk=200000):
+    """
+    [(path, tree, start, stop)] covering every entry of the inputs, in input order. inputs holds file paths,
+    read with the default tree, or (path, tree) pairs
+    """
+    import uproot
+    ranges = []
+    for item in inputs:
+        path, treename = (item, tree) if isinstance(item, str) else item
+        with uproot.open(path) as f:
+            n_entries = f[treename].num_entries
+        for start in range(0, n_entries, entries_per_chunk):
+            ranges.append((path, treename, start, min(start + entries_per_chunk, n_entries)))
+    return ranges
+
+
+def merge(a, b):
+    # b added into a, a returned
+    if isinstance(a, dict):
+        for key, value in b.items():
+            a[key] = merge(a[key], value) if key in a else value
+        return a
+    if isinstance(a, (list, tuple)):
+        return type(a)(merge(x, y) for x, y in zip(a, b))
+    if hasattr(a, 'merge'):
+        return a.merge(b)
+    if hasattr(a, 'Add'):
+        # TH1::Add, TEfficiency::Add
+        a.Add(b)
+        return a
+    return a + b
+
+
+class TreeReduction:
+
+    # Merges results pairwise as a binary counter over the chunk index: chunk results may arrive in any order but
+    # are always combined in the same tree, holding at most log2(n) partial results plus the out of order ones
+
+    def __init__(self):
+        self.pending = {}
+        self.stack = []
+        self.next_index = 0
+
+    def add(self, index, result):
+        self.pending[index] = result
+        while self.next_index in self.pending:
+            self.stack.append((0, self.pending.pop(self.next_index)))
+            self.next_index += 1
+            while len(self.stack) > 1 and self.stack[-1][0] == self.stack[-2][0]:
+                level, right = self.stack.pop()
+                self.stack[-1] = (level + 1, merge(self.stack[-1][1], right))
+
+    def result(self):
+        if not self.stack:
+            return None
+        result = self.stack[-1][1]
+        for level, left in reversed(self.stack[:-1]):
+            result = merge(left, result)
+        return result
+
+
+def run_chunk(function, path, tree, start, stop, branches):
+    # runs in a worker process, returns (result, entries)
+    import uproot
+    if 'ROOT' in sys.modules:
+        # every chunk books histograms with the same names, keep them out of gDirectory
+        sys.modules['ROOT'].gROOT.SetBatch(True)
+        sys.modules['ROOT'].TH1.AddDirectory(False)
+    with uproot.open(path) as f:
+        arrays = f[tree].arrays(branches, entry_start=start, entry_stop=stop)
+    return function(arrays), stop - start
+
+
+def run(function, inputs, branches, tree="miniT", entries_per_chunk=200000, n_workers=None, journal=None, progress=True, label=None, empty=None):
+    """
+    function(arrays) on every entry range of the inputs, reading only branches, results merged into one.
+    n_workers defaults to the number of cores, 1 runs the chunks one after another in this process.
+    journal is the path of a checkpoint journal to resume from and record to, kept after the run.
+    empty() is returned when the inputs have no entries (e.g. the function booking the empty histograms),
+    without it that raises a ValueError
+    """
+    ranges = entry_ranges(inputs, tree, entries_per_chunk)
+    if not ranges:
+        if empty is None:
+            raise ValueError(f"executor.run: no entries in tree {tree} of {inputs}")
+        print(f"No entries in tree {tree} of {inputs}")
+        return empty()
+    reduction = TreeReduction()
+    n_events = 0
+    start = time.time()
+
+    root = sys.modules.get('ROOT')
+    add_directory = root.TH1.AddDirectoryStatus() if root else None
+    if root:
+        # the merged histograms belong to the caller, not to whichever file happens to be open
+        root.TH1.AddDirectory(False)
+
+    done = None
+    if journal:
+        paths = [item if isinstance(item, str) else item[0] for item in inputs]
+        done = journals.Journal(journal, journals.job_key(paths, tree=tree, branches=sorted(branches), entries_per_chunk=entries_per_chunk,
+                                                          function=f"{function.__module__}.{function.__qualname__}"))
+    tracker = None
+    if progress and ranges:
+        tracker = journals.Progress(sum(stop - first for path, treename, first, stop in ranges), label or os.path.basename(ranges[0][0]))
+    todo = []
+    for index, chunk in enumerate(ranges):
+        if done and done.done(index):
+            reduction.add(index, done.load(index))
+            if tracker:
+                tracker.skip(chunk[3] - chunk[2])
+        else:
+            todo.append((index, chunk))
+    n_workers = min(n_workers or os.cpu_count(), max(len(todo), 1))
+
+    def finished(index, result, entries):
+        # checkpoint before merging, the merge adds into the result in place
+        if done:
+            done.finish(index, result, entries=entries)
+        reduction.add(index, result)
+        if tracker:
+            tracker.update(entries)
+
+    try:
+        if n_workers <= 1:
+            for index, chunk in todo:
+                result, entries = run_chunk(function, *chunk, branches)
+                finished(index, result, entries)
+                n_events += entries
+        else:
+            # spawn rather than fork so each worker starts its own ROOT
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futures = {pool.submit(run_chunk, function, *chunk, branches): index for index, chunk in todo}
+                for future in as_completed(futures):
+                    result, entries = future.result()
+                    finished(futures[future], result, entries)
+                    n_events += entries
+    finally:
+        if root:
+            root.TH1.AddDirectory(add_directory)
+
+    if tracker:
+        tracker.finish()
+    elapsed = time.time() - start
+    if len(todo) < len(ranges):
+        print(f"{len(ranges) - len(todo)} chunks taken from {journal}")
+    print(f"{len(todo)} chunks, {n_events} events with {n_workers} workers in {elapsed:.1f}s : {n_events/max(elapsed, 1e-9):.0f} events/s")
+    return reduction.result()
@@ -0,0 +1,166 @@
+'''
+Description: Streaming histogram accumulator for observables whose plotting range is not known in advance.
+    Counts are kept exactly on a fixed log-linear grid of fine bins (as in HdrHistogram): every power-of-two octave
+    of |x| is split into 2**precision_bits equal fine bins, and values closer to 0 than 2**(min_width_exp +
+    precision_bits) share linear bins of width 2**min_width_exp. A fine bin is therefore never wider than
+    2**-precision_bits of its values, whatever else was filled, so the quantile of the data is known to that relative
+    accuracy and a far outlier only adds its own fine bin instead of coarsening the rest. Only filled fine bins are
+    stored, at most 2**precision_bits per octave and axis; a 2D accumulator can hold up to one fine bin per entry, so
+    give it fewer precision_bits. Accumulators filled on different chunks or files can be
+    merged. Once everything is filled the final TH1F/TH2F range is taken from a quantile of the data, aligned so each
+    final bin is a whole number of fine bins, which can widen the final bins by up to nbins / 2**precision_bits.
+    Every fine bin also keeps the sums of x and x^2 (and y, y^2, xy in 2D) of its entries, so the converted histograms
+    get the same mean and RMS statistics as filling them entry by entry.
+Example
+    acc = histograms.FineHistogram()
+    for chunk in chunks:
+        acc.fill(chunk['pt'])
+    h_dp_pt = acc.to_th1("dp_pt", "dark photon pt; pT [GeV]; Events", 100, low=0, quantile=0.999, headroom=1.1)
+'''
+
+# IMPORTS ===========================================================================================================
+import math
+import numpy as np
+
+
+class FineHistogram:
+
+    def __init__(self, ndim=1, precision_bits=10, min_width_exp=-20):
+        self.ndim = ndim
+        self.precision_bits = precision_bits
+        self.min_width_exp = min_width_exp
+        # filled fine bins only: lower edge per axis, entries, and per bin sums of x, x^2 (1D) or x, x^2, y, y^2, xy (2D)
+        self.edges = np.zeros((0, ndim))
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((len(self.moments([np.zeros(0)] * ndim)), 0))
+        # entries dropped because a coordinate was nan or inf
+        self.skipped = 0
+
+    def width_exp(self, x):
+        # fine bins are 2**-precision_bits of the octave 2**e <= |x| < 2**(e+1) (2**e < |x| <= 2**(e+1) below 0)
+        mantissa, exponent = np.frexp(x)
+        octave = exponent - 1 - ((mantissa == -0.5) & (x < 0))
+        return np.maximum(octave - self.precision_bits, self.min_width_exp)
+
+    def fine_width(self, x):
+        return np.ldexp(1.0, self.width_exp(x))
+
+    def fine_edges(self, x):
+        # lower edge of the fine bin of every value, +0.0 turns -0.0 into 0.0
+        width_exp = self.width_exp(x)
+        return np.ldexp(np.floor(np.ldexp(x, -width_exp)), width_exp) + 0.0
+
+    def moments(self, values):
+        # the TH1/TH2 statistics sums of each entry, in the order PutStats takes them after sumw, sumw2
+        if self.ndim == 1:
+            return [values[0], values[0]**2]
+        return [values[0], values[0]**2, values[1], values[1]**2, values[0]*values[1]]
+
+    def add(self, edges, counts, sums):
+        # add fine bins (edges may repeat) into the stored ones, which stay unique and sorted
+        n_old = len(self.edges)
+        keys = np.concatenate([self.edges, edges])
+        if self.ndim == 1:
+            # the row-wise unique is several times slower
+            unique, inverse = np.unique(keys[:, 0], return_inverse=True)
+            self.edges = unique[:, np.newaxis]
+        else:
+            self.edges, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        old, new = inverse[:n_old], inverse[n_old:]
+        total = np.zeros(len(self.edges), dtype=np.int64)
+        total[old] = self.counts
+        total += np.bincount(new, weights=counts, minlength=len(self.edges)).astype(np.int64)
+        total_sums = np.zeros((len(self.sums), len(self.edges)))
+        total_sums[:, old] = self.sums
+        for k in range(len(self.sums)):
+            total_sums[k] += np.bincount(new, weights=sums[k], minlength=len(self.edges))
+        self.counts, self.sums = total, total_sums
+
+    def fill(self, *values):
+        values = [np.asarray(v, dtype=np.float64) for v in values]
+        finite = np.logical_and.reduce([np.isfinite(v) for v in values])
+        self.skipped += int(np.count_nonzero(~finite))
+        values = [v[finite] for v in values]
+        if len(values[0]) == 0:
+            return
+        edges = np.stack([self.fine_edges(v) for v in values], axis=1)
+        self.add(edges, np.ones(len(edges)), self.moments(values))
+
+    def merge(self, other):
+        # add the fine bins of other, both use the same fixed grid
+        if (other.precision_bits, other.min_width_exp) != (self.precision_bits, self.min_width_exp):
+            raise ValueError("FineHistogram.merge: the two accumulators have different fine grids")
+        if len(other.edges) > 0:
+            self.add(other.edges, other.counts, other.sums)
+        self.skipped += other.skipped
+        return self
+
+    def stats(self, inside):
+        # [sumw, sumw2, sumwx, sumwx2, ...] of the fine bins selected by inside, unit weights
+        n = float(self.counts[inside].sum())
+        return np.array([n, n] + [float(sums[inside].sum()) for sums in self.sums])
+
+    def quantile(self, axis, quantile):
+        # right edge of the fine bin holding the quantile of the entries along axis
+        edges, inverse = np.unique(self.edges[:, axis], return_inverse=True)
+        cumulative = np.cumsum(np.bincount(inverse.reshape(-1), weights=self.counts, minlength=len(edges)))
+        index = min(np.searchsorted(cumulative, quantile * cumulative[-1]), len(edges) - 1)
+        return edges[index] + self.fine_width(edges[index])
+
+    def axis_range(self, axis, nbins, low, quantile, headroom, default_max):
+        """
+        (low, high, width) for the final histogram: high is the quantile of the data times headroom, rounded up so
+        that every final bin is a whole number of fine bins. low is rounded down to a fine bin edge, 0 always is one
+        """
+        if self.counts.sum() == 0:
+            return low, default_max, (default_max - low) / nbins
+        target = self.quantile(axis, quantile) * headroom
+        unit = 0.0
+        while True:
+            # the widest fine bin in the range sets the step of the final edges
+            widest = self.fine_width(max(abs(low), abs(target)))
+            if widest == unit:
+                break
+            unit = widest
+            low = math.floor(low / unit) * unit
+            width = max(math.ceil((target - low) / (nbins * unit)), 1) * unit
+            target = max(target, low + nbins * width)
+        return low, low + nbins * width, width
+
+    def final_bins(self, axis, nbins, low, width):
+        # final histogram bin (0 underflow, nbins+1 overflow) of every stored fine bin
+        bins = np.floor_divide(self.edges[:, axis] - low, width) + 1
+        return np.clip(bins, 0, nbins + 1).astype(np.int64)
+
+    def to_th1(self, name, title, nbins, low=0.0, quantile=0.999, headroom=1.0, default_max=1.0, overflow_to_last_bin=False):
+        """
+        overflow_to_last_bin moves the overflow into the last bin and keeps those entries in the mean and RMS,
+        otherwise the statistics cover the entries inside the axis range, as for TH1::Fill
+        """
+        import ROOT
+        low, high, width = self.axis_range(0, nbins, low, quantile, headroom, default_max)
+        hist = ROOT.TH1F(name, title, nbins, low, high)
+        if len(self.counts) > 0:
+            bins = self.final_bins(0, nbins, low, width)
+            if overflow_to_last_bin:
+                bins = np.minimum(bins, nbins)
+            contents = np.bincount(bins, weights=self.counts, minlength=nbins + 2)
+            hist.SetContent(contents.astype(np.float64))
+            hist.PutStats(self.stats((bins >= 1) & (bins <= nbins)))
+        hist.SetEntries(float(self.counts.sum()))
+        return hist
+
+    def to_th2(self, name, title, nbins, low=(0.0, 0.0), quantile=0.999, headroom=(1.0, 1.0), default_max=(1.0, 1.0)):
+        import ROOT
+        ranges = [self.axis_range(axis, nbins[axis], low[axis], quantile, headroom[axis], default_max[axis]) for axis in range(2)]
+        hist = ROOT.TH2F(name, title, nbins[0], ranges[0][0], ranges[0][1], nbins[1], ranges[1][0], ranges[1][1])
+        if len(self.counts) > 0:
+            binx = self.final_bins(0, nbins[0], ranges[0][0], ranges[0][2])
+            biny = self.final_bins(1, nbins[1], ranges[1][0], ranges[1][2])
+            # ROOT global bin = binx + (nbinsx + 2) * biny
+            contents = np.bincount(binx + (nbins[0] + 2) * biny, weights=self.counts, minlength=(nbins[0] + 2) * (nbins[1] + 2))
+            hist.SetContent(contents.astype(np.float64))
+            hist.PutStats(self.stats((binx >= 1) & (binx <= nbins[0]) & (biny >= 1) & (biny <= nbins[1])))
+        hist.SetEntries(float(self.counts.sum()))
+        return hist
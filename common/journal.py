@@ -0,0 +1,131 @@
+'''
+Description: Checkpoint journal and progress line for long chunked jobs.
+    A Journal is a small JSON file next to the outputs. It records which chunks of a job are finished and where
+    each partial output is saved. A restarted job with the same key (input paths, sizes and mtimes plus the job
+    settings) skips the finished chunks. A different key starts the job over. The journal is rewritten atomically
+    after every chunk, so a crash only loses the chunks still running.
+    Progress prints the fraction done, events/s and the ETA on one line, redrawn in place on a terminal.
+Example
+    done = journal.Journal("output/job.journal.json", journal.job_key(inputs, branches=branches))
+    progress = journal.Progress(n_entries, "frvz_vbf_500757")
+    for index, (start, stop) in enumerate(chunks):
+        if done.done(index):
+            progress.skip(stop - start); continue
+        ...
+        done.finish(index, result, entries=stop - start)
+        progress.update(stop - start)
+    progress.finish()
+'''
+
+# IMPORTS ===========================================================================================================
+import hashlib, json, os, pickle, shutil, sys, time
+
+
+def job_key(paths, **settings):
+    # changes whenever an input file is replaced or rewritten, or a setting changes
+    key = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        key.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    key.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return key.hexdigest()
+
+
+def remove(path):
+    # delete a journal and its partial outputs, once the final output is written
+    if os.path.exists(path):
+        os.remove(path)
+    shutil.rmtree(path + '.d', ignore_errors=True)
+
+
+class Journal:
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.partdir = path + '.d'
+        self.chunks = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get('key') == key:
+                self.chunks = {int(index): record for index, record in saved['chunks'].items()}
+            else:
+                print(f"{path} belongs to a different job, starting again")
+                remove(path)
+        if self.chunks:
+            print(f"Resuming from {path}: {len(self.chunks)} chunks already done")
+
+    def done(self, index):
+        return index in self.chunks
+
+    def part_path(self, index, suffix='.pkl'):
+        # where the partial output of a chunk lives, for callers writing their own files
+        os.makedirs(self.partdir, exist_ok=True)
+        return os.path.join(self.partdir, f"chunk_{index:06d}{suffix}")
+
+    def finish(self, index, result=None, **info):
+        # record a finished chunk, result (if given) is pickled to its part file first
+        record = dict(info)
+        if result is not None:
+            record['file'] = self.part_path(index)
+            with open(record['file'] + '.tmp', 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(record['file'] + '.tmp', record['file'])
+        self.chunks[index] = record
+        self.save()
+
+    def load(self, index):
+        with open(self.chunks[index]['file'], 'rb') as f:
+            return pickle.load(f)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'key': self.key, 'chunks': self.chunks}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class Progress:
+
+    def __init__(self, total, label="", interval=None):
+        self.total = total
+        self.label = label
+        self.tty = sys.stdout.isatty()
+        # redraw every second on a terminal, keep batch logs short
+        self.interval = interval if interval is not None else (1 if self.tty else 30)
+        self.done = 0
+        self.skipped = 0
+        self.events = 0
+        self.start = time.time()
+        self.last = 0
+
+    def skip(self, done):
+        # work finished by an earlier run, counts towards the fraction but not the rate
+        self.done += done
+        self.skipped += done
+
+    def update(self, done, events=None):
+        # done is in the units of total, events defaults to done
+        self.done += done
+        self.events += done if events is None else events
+        if time.time() - self.last >= self.interval:
+            self.show()
+
+    def line(self):
+        elapsed = max(time.time() - self.start, 1e-9)
+        fraction = self.done / self.total if self.total else 1
+        new = self.done - self.skipped
+        eta = (self.total - self.done) * elapsed / new if new > 0 else float('nan')
+        eta = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta == eta else '--:--:--'
+        return f"{self.label}: {100*fraction:5.1f}% {self.events/elapsed:.0f} events/s ETA {eta}"
+
+    def show(self, end=None):
+        self.last = time.time()
+        if self.tty:
+            print('\r' + self.line(), end=end if end is not None else '', flush=True)
+        else:
+            print(self.line(), flush=True)
+
+    def finish(self):
+        self.show(end='\n')
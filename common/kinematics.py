@@ -0,0 +1,194 @@
+'''
+Description: Columnar four-vector helpers for the truth and lepton jet scripts, replacing one TLorentzVector per object.
+    Everything works on flat numpy arrays and on jagged awkward arrays (numpy ufuncs dispatch to awkward), and follows
+    the TLorentzVector conventions: DeltaPhi wrapped into [-pi, pi), M keeps the sign of m^2, SetPtEtaPhiM with a
+    negative mass. Four-vectors are dicts of px, py, pz, e. With numba installed the flat delta_r runs as one compiled
+    loop, without it the same numpy expression is used.
+    tests/test_kinematics.py checks closed-form values on numpy and awkward inputs and, with ROOT, TLorentzVector.
+    Run this file directly to print the same comparison and the cost per object.
+Example
+    pt, e = arrays.truthPt * kinematics.MEV_TO_GEV, arrays.truthE * kinematics.MEV_TO_GEV
+    dp = kinematics.from_pt_eta_phi_e(pt, arrays.truthEta, arrays.truthPhi, e)
+    ctau = kinematics.ctau(kinematics.decay_length(x, y, z), kinematics.p(dp), kinematics.mass(dp))
+    python3 common/kinematics.py
+'''
+
+# IMPORTS ===========================================================================================================
+import time
+import numpy as np
+import awkward as ak
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# The ntuples store momenta in MeV and vertices in mm
+MEV_TO_GEV = 1e-3
+MM_TO_M = 1e-3
+
+
+def _where(condition, x, y):
+    return ak.where(condition, x, y) if isinstance(condition, ak.Array) else np.where(condition, x, y)
+
+
+# Constructors and components -------------------------------------------------------------------------------------
+
+def from_pt_eta_phi_e(pt, eta, phi, e):
+    # TLorentzVector::SetPtEtaPhiE
+    pt = abs(pt)
+    return {'px': pt * np.cos(phi), 'py': pt * np.sin(phi), 'pz': pt * np.sinh(eta), 'e': e}
+
+
+def from_pt_eta_phi_m(pt, eta, phi, m):
+    # TLorentzVector::SetPtEtaPhiM, a negative mass gives E = sqrt(max(p^2 - m^2, 0))
+    v = from_pt_eta_phi_e(pt, eta, phi, 0)
+    p2 = v['px']**2 + v['py']**2 + v['pz']**2
+    v['e'] = np.sqrt(np.maximum(p2 + m * abs(m), 0))
+    return v
+
+
+def add(*vectors):
+    return {key: sum(v[key] for v in vectors) for key in ('px', 'py', 'pz', 'e')}
+
+
+def pt(v):
+    return np.sqrt(v['px']**2 + v['py']**2)
+
+
+def p(v):
+    return np.sqrt(v['px']**2 + v['py']**2 + v['pz']**2)
+
+
+def eta(v):
+    # TLorentzVector::Eta, +-1e11 along the beam axis
+    transverse = pt(v)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        along_beam = _where(v['pz'] > 0, 1e11, _where(v['pz'] < 0, -1e11, 0.0))
+        return _where(transverse > 0, np.arcsinh(v['pz'] / transverse), along_beam)
+
+
+def phi(v):
+    return np.arctan2(v['py'], v['px'])
+
+
+def mass(v):
+    # TLorentzVector::M keeps the sign of m^2
+    m2 = v['e']**2 - p(v)**2
+    return np.sign(m2) * np.sqrt(abs(m2))
+
+
+def invariant_mass(*vectors):
+    return mass(add(*vectors))
+
+
+def momentum(pt, eta):
+    # |p| from pt and eta without building the vector
+    return pt * np.cosh(eta)
+
+
+# Angular distances -----------------------------------------------------------------------------------------------
+
+def delta_phi(phi1, phi2):
+    # same as TLorentzVector::DeltaPhi, wrapped into [-pi, pi)
+    return (phi1 - phi2 + np.pi) % (2*np.pi) - np.pi
+
+
+if numba is not None:
+    @numba.njit
+    def _delta_r_flat(eta1, phi1, eta2, phi2):
+        out = np.empty(len(eta1))
+        for i in range(len(eta1)):
+            dphi = (phi1[i] - phi2[i] + np.pi) % (2*np.pi) - np.pi
+            out[i] = np.sqrt((eta1[i] - eta2[i])**2 + dphi**2)
+        return out
+
+
+def delta_r(eta1, phi1, eta2, phi2):
+    # same as TLorentzVector::DeltaR, broadcasts like the numpy/awkward operators
+    args = (eta1, phi1, eta2, phi2)
+    if numba is not None and all(isinstance(a, np.ndarray) and a.ndim == 1 and a.shape == eta1.shape for a in args):
+        return _delta_r_flat(*(np.asarray(a, dtype=np.float64) for a in args))
+    return np.sqrt((eta1 - eta2)**2 + delta_phi(phi1, phi2)**2)
+
+
+# Decay lengths ---------------------------------------------------------------------------------------------------
+
+def lxy(x, y):
+    return np.sqrt(x**2 + y**2)
+
+
+def decay_length(x, y, z):
+    return np.sqrt(x**2 + y**2 + z**2)
+
+
+def ctau(length, p, m):
+    # proper decay length L m / p, nan where p is 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _where(p > 0, length / p * m, np.nan)
+
+
+# Checks ----------------------------------------------------------------------------------------------------------
+
+def compare_to_tlorentzvector(n=2000, seed=1):
+    # largest relative difference of each helper against TLorentzVector on random objects
+    import ROOT
+    rng = np.random.default_rng(seed)
+    pt1, pt2 = rng.exponential(50, n), rng.exponential(50, n)
+    eta1, eta2 = rng.uniform(-4, 4, n), rng.uniform(-4, 4, n)
+    phi1, phi2 = rng.uniform(-np.pi, np.pi, n), rng.uniform(-np.pi, np.pi, n)
+    m1, m2 = rng.uniform(-0.5, 5, n), rng.uniform(0, 5, n)
+
+    v1, v2 = from_pt_eta_phi_m(pt1, eta1, phi1, m1), from_pt_eta_phi_m(pt2, eta2, phi2, m2)
+    total = add(v1, v2)
+    ours = {'E': v1['e'], 'P': p(v1), 'M': mass(v1), 'DeltaR': delta_r(eta1, phi1, eta2, phi2),
+            'sum M': mass(total), 'sum Pt': pt(total), 'sum Eta': eta(total), 'sum Phi': phi(total)}
+    theirs = {key: np.empty(n) for key in ours}
+    for i in range(n):
+        t1, t2 = ROOT.TLorentzVector(), ROOT.TLorentzVector()
+        t1.SetPtEtaPhiM(pt1[i], eta1[i], phi1[i], m1[i]); t2.SetPtEtaPhiM(pt2[i], eta2[i], phi2[i], m2[i])
+        t = t1 + t2
+        theirs['E'][i], theirs['P'][i], theirs['M'][i], theirs['DeltaR'][i] = t1.E(), t1.P(), t1.M(), t1.DeltaR(t2)
+        theirs['sum M'][i], theirs['sum Pt'][i], theirs['sum Eta'][i], theirs['sum Phi'][i] = t.M(), t.Pt(), t.Eta(), t.Phi()
+    return {key: np.max(np.abs(ours[key] - theirs[key]) / np.maximum(np.abs(theirs[key]), 1)) for key in ours}
+
+
+def benchmark(n=1000000, repeat=5, seed=1):
+    # best of repeat, in ns per object
+    rng = np.random.default_rng(seed)
+    pt1, eta1, phi1, m1 = rng.exponential(50, n), rng.uniform(-4, 4, n), rng.uniform(-np.pi, np.pi, n), rng.uniform(0, 5, n)
+    pt2, eta2, phi2, m2 = rng.exponential(50, n), rng.uniform(-4, 4, n), rng.uniform(-np.pi, np.pi, n), rng.uniform(0, 5, n)
+    x, y, z = rng.normal(0, 1000, n), rng.normal(0, 1000, n), rng.normal(0, 1000, n)
+    jobs = {
+        'delta_r': lambda: delta_r(eta1, phi1, eta2, phi2),
+        'from_pt_eta_phi_m': lambda: from_pt_eta_phi_m(pt1, eta1, phi1, m1),
+        'invariant_mass': lambda: invariant_mass(from_pt_eta_phi_m(pt1, eta1, phi1, m1), from_pt_eta_phi_m(pt2, eta2, phi2, m2)),
+        'ctau': lambda: ctau(decay_length(x, y, z), momentum(pt1, eta1), m1),
+    }
+    timings = {}
+    for name, job in jobs.items():
+        job()
+        best = min(_timed(job) for _ in range(repeat))
+        timings[name] = best / n * 1e9
+    return timings
+
+
+def _timed(job):
+    start = time.perf_counter()
+    job()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    try:
+        differences = compare_to_tlorentzvector()
+    except ImportError:
+        print("ROOT not available, skipping the TLorentzVector comparison")
+    else:
+        for name, difference in differences.items():
+            print(f"{name:10s} max relative difference to TLorentzVector: {difference:.2e}")
+        assert all(difference < 1e-9 for difference in differences.values())
+
+    print(f"numba: {'yes' if numba is not None else 'no'}")
+    for name, ns in benchmark().items():
+        print(f"{name:20s} {ns:7.1f} ns per object")
@@ -0,0 +1,12 @@
+'''
+Description: Named event preselections shared by the training, ROC and skim scripts, as TTreeFormula/RDataFrame strings.
+    A skim made with scripts/skim.py -p <name> records the name in its manifest, so downstream jobs can see that
+    the cut has already been applied.
+'''
+
+PRESELECTIONS = {
+    # at least one lepton jet, with the leading one passing the pt, gap ratio and EM fraction cuts
+    "ljet": "nLJjets20>0&&LJjet1_pt>20e3&&LJjet1_gapRatio>0.9&&LJjet1_EMfrac<0.4",
+    # no cut, for skims that only drop branches
+    "none": "1",
+}
@@ -0,0 +1,89 @@
+'''
+Description: Columnar dark photon truth observables for whole chunks of events read with uproot.iterate.
+    Daughters are joined to their dark photon with one sort of the child particles by (event, childMomBarcode)
+    and a searchsorted of the dark photon (event, truthBarcode) keys, instead of scanning the child vector
+    for every dark photon. Kinematics follow TLorentzVector (SetPtEtaPhiE for the dark photon, massless daughters),
+    computed with the kinematics module. tests/test_truth.py checks the join against a per dark photon loop.
+Example
+    for arrays in uproot.iterate({path: "miniT"}, truth.truth_branches, step_size="100 MB"):
+        dps = truth.dark_photons(arrays)
+        two = dps['n_daughters'] == 2
+        truth.fill(h_dp_deltaR, dps['deltaR'][two])
+'''
+
+# IMPORTS ===========================================================================================================
+import numpy as np
+import awkward as ak
+import kinematics
+
+DARK_PHOTON = 3000001
+
+truth_branches = ["truthPdgId", "truthBarcode", "truthPt", "truthEta", "truthPhi", "truthE",
+                  "truthDecayVtx_x", "truthDecayVtx_y", "truthDecayVtx_z",
+                  "childMomBarcode", "childPt", "childEta", "childPhi"]
+
+
+def join_keys(event, barcode):
+    # one int64 per (event in chunk, barcode) pair, so a single sort groups the children by parent
+    return event.astype(np.int64) * 2**32 + (barcode.astype(np.int64) & 0xFFFFFFFF)
+
+
+def dark_photons(arrays):
+    """
+    Flat numpy arrays with one entry per dark photon in the chunk: pt [GeV], eta, phi, m [GeV], p [GeV],
+    lxy, lz [mm], ctau [mm] (nan if p is 0), n_daughters, deltaR between the two daughters (nan unless there are
+    exactly two) and the approximation approx_deltaR = 2m/pT (nan if pT is 0)
+    """
+    is_dp = arrays.truthPdgId == DARK_PHOTON
+    dp_event = ak.to_numpy(ak.flatten(ak.broadcast_arrays(np.arange(len(arrays)), arrays.truthPdgId)[0][is_dp]))
+
+    def dp_column(name):
+        return ak.to_numpy(ak.flatten(arrays[name][is_dp])).astype(np.float64)
+
+    pt = dp_column("truthPt") * kinematics.MEV_TO_GEV
+    eta = dp_column("truthEta")
+    phi = dp_column("truthPhi")
+    e = dp_column("truthE") * kinematics.MEV_TO_GEV
+    dx, dy, dz = dp_column("truthDecayVtx_x"), dp_column("truthDecayVtx_y"), dp_column("truthDecayVtx_z")
+
+    dp = kinematics.from_pt_eta_phi_e(pt, eta, phi, e)
+    p = kinematics.p(dp)
+    m = kinematics.mass(dp)
+
+    # children sorted by (event, mother barcode), the daughters of each dark photon are then one contiguous range
+    child_event = np.repeat(np.arange(len(arrays)), ak.to_numpy(ak.num(arrays.childMomBarcode)))
+    child_keys = join_keys(child_event, ak.to_numpy(ak.flatten(arrays.childMomBarcode)))
+    order = np.argsort(child_keys, kind='stable')
+    sorted_keys = child_keys[order]
+    dp_keys = join_keys(dp_event, ak.to_numpy(ak.flatten(arrays.truthBarcode[is_dp])))
+    first = np.searchsorted(sorted_keys, dp_keys, side='left')
+    n_daughters = np.searchsorted(sorted_keys, dp_keys, side='right') - first
+
+    # deltaR of the first two daughters, kept where there are exactly two
+    child_eta = ak.to_numpy(ak.flatten(arrays.childEta)).astype(np.float64)
+    child_phi = ak.to_numpy(ak.flatten(arrays.childPhi)).astype(np.float64)
+    two = n_daughters == 2
+    daughter1, daughter2 = order[first[two]], order[first[two] + 1]
+    deltaR = np.full(len(first), np.nan)
+    deltaR[two] = kinematics.delta_r(child_eta[daughter1], child_phi[daughter1], child_eta[daughter2], child_phi[daughter2])
+
+    ctau = kinematics.ctau(kinematics.decay_length(dx, dy, dz), p, m)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        approx_deltaR = np.where(pt > 0, 2 * m / pt, np.nan)
+
+    return {
+        'pt': pt, 'eta': eta, 'phi': phi, 'm': m, 'p': p,
+        'lxy': kinematics.lxy(dx, dy), 'lz': np.abs(dz), 'ctau': ctau,
+        'n_daughters': n_daughters, 'deltaR': deltaR, 'approx_deltaR': approx_deltaR,
+    }
+
+
+def fill(hist, x, y=None):
+    # bulk fill with unit weights, same binning as hist.Fill(x) / hist.Fill(x, y)
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    if len(x) == 0:
+        return
+    if y is None:
+        hist.FillN(len(x), x, np.ones(len(x)))
+    else:
+        hist.FillN(len(x), x, np.ascontiguousarray(y, dtype=np.float64), np.ones(len(x)))
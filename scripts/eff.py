@@ -1,67 +1,76 @@
 import ROOT
 import os
-import math
-from ROOT import TFile, TCanvas, TLorentzVector, gStyle, TEfficiency
+import numpy as np
+import awkward as ak
+import sys
+from ROOT import TFile, TCanvas, gStyle, TEfficiency
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from kinematics import delta_r, lxy, MEV_TO_GEV, MM_TO_M
+import executor
 
 input_file_path = "/Users/sirawitsae/Desktop/project/DarkPhoton/vbfljetskim/frvz_vbf_500764.root" ####### Input file here ##########
 output_dir = "output_eff_plot/eff_plots_64/" ####### directory name eff_plots_(DSID) ##########
-    
-print(f"--- Calculating Efficiency and Fake Rate for {os.path.basename(input_file_path)} ---")
-
-os.makedirs(output_dir, exist_ok=True)
-input_file = TFile.Open(input_file_path, "READ")
-tree = input_file.Get("miniT")
-
-output_file = TFile(os.path.join(output_dir, "eff_plots.root"), "RECREATE")
-
-# Define Histograms 
-lxy_bins = (20, 0, 5.0) 
-pt_bins = (20, 0, 100) 
-
-h_num_eff_lxy = ROOT.TH1F("h_num_eff_lxy", "", *lxy_bins)
-h_den_eff_lxy = ROOT.TH1F("h_den_eff_lxy", "", *lxy_bins)
-h_num_eff_pt = ROOT.TH1F("h_num_eff_pt", "", *pt_bins)
-h_den_eff_pt = ROOT.TH1F("h_den_eff_pt", "", *pt_bins)
-
-# Loop through events to fill all histograms
-for i in range(tree.GetEntries()):
-    tree.GetEntry(i)
-
-    # Collect all truth DPs in the event
-    truth_dps = []
-    for j in range(len(tree.truthPdgId)):
-        if tree.truthPdgId[j] == 3000001:
-            if abs(tree.truthEta[j]) < 1.1 and tree.truthPt[j] > 20e3 and tree.truthDecayType[j] != 13: # PdgId = 13 is Muon
-                p4 = TLorentzVector()
-                p4.SetPtEtaPhiE(tree.truthPt[j]*0.001, tree.truthEta[j], tree.truthPhi[j], tree.truthE[j]*0.001)
-                dx = tree.truthDecayVtx_x[j]; dy = tree.truthDecayVtx_y[j]
-                truth_dps.append({'p4': p4, 'lxy': math.sqrt(dx**2 + dy**2)})
-        
-    if not truth_dps: continue # If no event collected
-
-    # Denominator: Every truth DP that exists
-    for dp in truth_dps:
-        lxy_m = dp['lxy'] * 0.001 # convert to meters
-        pt = dp['p4'].Pt()
-        h_den_eff_lxy.Fill(lxy_m)
-        h_den_eff_pt.Fill(pt)
-            
-        # Numerator: Check if this truth DP is matched to the reco jet
-        if tree.nLJjets20 > 0: # Apply cuts to LJjet
-            for k in range(len(tree.LJjet_index)):
-                if tree.LJjet_EMfrac[k] < 0.4 and tree.LJjet_gapRatio[k] > 0.9 and tree.LJjet_pt[k] > 20e3:
-                    reco_p4 = TLorentzVector()
-                    # Use the correct array branches for the k-th jet
-                    reco_p4.SetPtEtaPhiM(tree.LJjet_pt[k]*0.001, tree.LJjet_eta[k], tree.LJjet_phi[k], tree.LJjet_m[k]*0.001)
-                    
-            if dp['p4'].DeltaR(reco_p4) < 0.4:
-                h_num_eff_lxy.Fill(lxy_m)
-                h_num_eff_pt.Fill(pt)
-
-# Create, Plot, and Save TEfficiency objects
-canvas = TCanvas("c_plots", "Performance Canvas", 800, 600); gStyle.SetOptStat(0)
-    
-def create_and_save_plot(num, den, name, title, xtitle, ytitle):
+n_workers = os.cpu_count() # chunks of the file filled in parallel, 1 fills them one after another
+
+# Only these branches are read
+eff_branches = ["truthPdgId", "truthPt", "truthEta", "truthPhi", "truthDecayType", "truthDecayVtx_x", "truthDecayVtx_y",
+                "nLJjets20", "LJjet_pt", "LJjet_eta", "LJjet_phi", "LJjet_EMfrac", "LJjet_gapRatio"]
+
+# Define Histograms
+lxy_bins = (20, 0, 5.0)
+pt_bins = (20, 0, 100)
+
+def fill(hist, values):
+    # bulk fill with unit weights, same binning as hist.Fill
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) > 0:
+        hist.FillN(len(values), values, np.ones(len(values)))
+
+def truth_dps(arrays):
+    # jagged truth dark photons per event, same acceptance as the reco efficiency denominator
+    is_dp = (arrays.truthPdgId == 3000001) & (abs(arrays.truthEta) < 1.1) & (arrays.truthPt > 20e3) & (arrays.truthDecayType != 13) # PdgId = 13 is Muon
+    return ak.zip({
+        'pt': arrays.truthPt[is_dp]*MEV_TO_GEV,
+        'eta': arrays.truthEta[is_dp],
+        'phi': arrays.truthPhi[is_dp],
+        'lxy': lxy(arrays.truthDecayVtx_x[is_dp], arrays.truthDecayVtx_y[is_dp])*MM_TO_M, # convert to meters
+    })
+
+def selected_jets(arrays):
+    # jagged reco lepton jets passing the cuts, none in events without a 20 GeV lepton jet
+    is_good = (arrays.LJjet_EMfrac < 0.4) & (arrays.LJjet_gapRatio > 0.9) & (arrays.LJjet_pt > 20e3) & (arrays.nLJjets20 > 0)
+    return ak.zip({'eta': arrays.LJjet_eta[is_good], 'phi': arrays.LJjet_phi[is_good]})
+
+def match_dps(dps, jets):
+    # a truth DP is matched if any selected jet of its event is within DeltaR < 0.4, all truth x jet pairs at once
+    pairs = ak.cartesian({'dp': dps, 'jet': jets}, nested=True)
+    dr = delta_r(pairs.dp.eta, pairs.dp.phi, pairs.jet.eta, pairs.jet.phi)
+    return ak.any(dr < 0.4, axis=-1)
+
+def book_histograms():
+    return {
+        'num_lxy': ROOT.TH1F("h_num_eff_lxy", "", *lxy_bins),
+        'den_lxy': ROOT.TH1F("h_den_eff_lxy", "", *lxy_bins),
+        'num_pt': ROOT.TH1F("h_num_eff_pt", "", *pt_bins),
+        'den_pt': ROOT.TH1F("h_den_eff_pt", "", *pt_bins),
+    }
+
+def fill_efficiency(arrays, hists):
+    dps = truth_dps(arrays)
+    matched = match_dps(dps, selected_jets(arrays))
+    # Denominator: Every truth DP that exists, numerator: those matched to a reco jet
+    fill(hists['den_lxy'], ak.flatten(dps.lxy))
+    fill(hists['den_pt'], ak.flatten(dps.pt))
+    fill(hists['num_lxy'], ak.flatten(dps.lxy[matched]))
+    fill(hists['num_pt'], ak.flatten(dps.pt[matched]))
+
+def efficiency_chunk(arrays):
+    # one entry range in an executor worker, the histograms of all ranges are added up by executor.run
+    hists = book_histograms()
+    fill_efficiency(arrays, hists)
+    return hists
+
+def create_and_save_plot(canvas, output_file, output_dir, num, den, name, title, xtitle, ytitle):
     eff = TEfficiency(num, den)
     eff.SetName(name)
     eff.SetTitle(f"{title};{xtitle};{ytitle}")
@@ -69,9 +78,23 @@ def create_and_save_plot(num, den, name, title, xtitle, ytitle):
     canvas.Print(os.path.join(output_dir, f"{name}.png"))
     output_file.cd(); eff.Write(name)
 
-create_and_save_plot(h_num_eff_lxy, h_den_eff_lxy, "efficiency_vs_lxy", "Efficiency", "Truth DP L_{xy} [m]", "Efficiency")
-create_and_save_plot(h_num_eff_pt, h_den_eff_pt, "efficiency_vs_pt", "Efficiency", "Truth DP p_{T} [GeV]", "Efficiency")
-  
-print(f"\nEfficiency plots saved to directory: {output_dir}")
-output_file.Close(); input_file.Close()
+def save_plots(hists, output_dir):
+    # Create, Plot, and Save TEfficiency objects to output_dir/eff_plots.root
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = TFile(os.path.join(output_dir, "eff_plots.root"), "RECREATE")
+    canvas = TCanvas("c_plots", "Performance Canvas", 800, 600); gStyle.SetOptStat(0)
+    create_and_save_plot(canvas, output_file, output_dir, hists['num_lxy'], hists['den_lxy'], "efficiency_vs_lxy", "Efficiency", "Truth DP L_{xy} [m]", "Efficiency")
+    create_and_save_plot(canvas, output_file, output_dir, hists['num_pt'], hists['den_pt'], "efficiency_vs_pt", "Efficiency", "Truth DP p_{T} [GeV]", "Efficiency")
+    output_file.Close()
+    print(f"\nEfficiency plots saved to directory: {output_dir}")
+
+def main():
+    print(f"--- Calculating Efficiency and Fake Rate for {os.path.basename(input_file_path)} ---")
+
+    # Read the truth and jet collections in entry ranges spread over n_workers processes, one set of histograms per range
+    hists = executor.run(efficiency_chunk, [input_file_path], eff_branches, n_workers=n_workers, empty=book_histograms)
+
+    save_plots(hists, output_dir)
 
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,10 @@
 import ROOT
 import os
-import math
-import re
-from array import array
-from ROOT import TFile, TCanvas, TLorentzVector, gStyle
+import sys
+import uproot
+from ROOT import TFile, gStyle
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import truth
 
 input_base_dir = '/Users/sirawitsae/Desktop/project/DarkPhoton/vbfskim/' 
 input_file_paths = [os.path.join(input_base_dir, 'frvz_vbf_500760.root')] ######### Change here #########
@@ -18,9 +19,7 @@ for path in input_file_paths:
         outputDir = f"2D_ctau_{base_name}"
         os.makedirs(outputDir, exist_ok=True)
 
-        myfile = TFile.Open(path, "READ")
-        tree = myfile.Get("miniT")
-        if not tree: continue
+        if "miniT" not in uproot.open(path): continue
 
         outputRootPath = os.path.join(outputDir, f"histograms_{base_name}.root")
         outputFile = TFile(outputRootPath, "RECREATE")
@@ -38,37 +37,18 @@ for path in input_file_paths:
     h_deltaR_vs_2mPt = ROOT.TH2F("deltaR_vs_2mPt", "True #DeltaR vs. 2m/p_{T} Approximation;Approximation (2m/p_{T});True #DeltaR",
                                  100, 0, 0.2, 100, 0, 0.2)
 
-    # Loop through events and fill all histograms 
-    for i in range(tree.GetEntries()):
-        tree.GetEntry(i)
-        dark_photon_indices = [j for j, pdgId in enumerate(tree.truthPdgId) if pdgId == 3000001]
-        if not dark_photon_indices: continue
-
-        for dp_idx in dark_photon_indices:
-            # Create the TLorentzVector from the correct branches
-            p4 = TLorentzVector()
-            p4.SetPtEtaPhiE(tree.truthPt[dp_idx] * 0.001, tree.truthEta[dp_idx], tree.truthPhi[dp_idx], tree.truthE[dp_idx] * 0.001)
-
-            # Find daughters using the 'child' branches
-            dp_barcode = tree.truthBarcode[dp_idx]
-            daughters = []
-            for k in range(len(tree.childPdgId)):
-                if tree.childMomBarcode[k] == dp_barcode:
-                    daughter_p4 = TLorentzVector()
-                    daughter_p4.SetPtEtaPhiM(tree.childPt[k] * 0.001, tree.childEta[k], tree.childPhi[k], 0)
-                    daughters.append(daughter_p4)
-            
-            if len(daughters) == 2:
-                deltaR = daughters[0].DeltaR(daughters[1])
-                
-                # Calculate the approximation and fill the 2D plot
-                if p4.Pt() > 0:
-                    approx_deltaR = (2 * p4.M()) / p4.Pt()
-                    h_deltaR_vs_2mPt.Fill(approx_deltaR, deltaR)
-
-                # Fill 1D histograms as before
-                h_dp_pt.Fill(p4.Pt())
-                h_dp_deltaR.Fill(deltaR)
+    # Read chunks of events and fill all histograms, daughters joined by barcode in truth.dark_photons
+    for arrays in uproot.iterate({path: "miniT"}, truth.truth_branches, step_size="100 MB"):
+        dps = truth.dark_photons(arrays)
+        two = dps['n_daughters'] == 2
+
+        # Calculate the approximation and fill the 2D plot
+        has_approx = two & (dps['pt'] > 0)
+        truth.fill(h_deltaR_vs_2mPt, dps['approx_deltaR'][has_approx], dps['deltaR'][has_approx])
+
+        # Fill 1D histograms as before
+        truth.fill(h_dp_pt, dps['pt'][two])
+        truth.fill(h_dp_deltaR, dps['deltaR'][two])
 
 
     # Write all objects to file and clean up
@@ -98,7 +78,6 @@ for path in input_file_paths:
     print(f"All plots saved in {outputDir}")
 
     outputFile.Close()
-    myfile.Close()
 
 print("-" * 50)
 print("All files processed.")
\ No newline at end of file
@@ -0,0 +1,83 @@
+'''
+Description: Efficiency and matched/fake rates for a list of signal samples, one read per file.
+    Every file is processed in its own process and each chunk of events fills both the eff.py and the FakeRate.py
+    histograms. The outputs keep the per DSID layout read by overlay_eff.py and overlay_fakerate.py:
+    output_eff_plot/eff_plots_<NN>/eff_plots.root and output_fake_plot/rates_plots_<NN>/rates_plots.root,
+    with NN the last two digits of the DSID.
+Example running script over the whole signal grid
+python3 signal_grid.py -i /data/vbfljetskim/frvz_vbf_50075*.root /data/vbfljetskim/frvz_vbf_50076*.root -j 8
+'''
+
+# IMPORTS ===========================================================================================================
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import argparse, os, re, time
+
+
+def find_dsid(ip_path):
+    # the 6 digit DSID in the file name, None if there is none
+    match = re.search(r'(\d{6})', os.path.basename(ip_path))
+    return match.group(1) if match else None
+
+
+def output_dirs(ip_path, eff_dir, rates_dir):
+    # eff_plots_57 / rates_plots_57 for frvz_vbf_500757.root
+    dsid = find_dsid(ip_path)
+    return os.path.join(eff_dir, f"eff_plots_{dsid[-2:]}"), os.path.join(rates_dir, f"rates_plots_{dsid[-2:]}")
+
+
+def process_file(ip_path, eff_dir, rates_dir, step_size):
+    # runs in a worker process, returns (file, events, seconds)
+    import ROOT
+    import uproot
+    import eff
+    import FakeRate
+    ROOT.gROOT.SetBatch(True)
+    start = time.time()
+
+    eff_hists = eff.book_histograms()
+    rate_hists = FakeRate.book_histograms()
+    n_events = 0
+    for arrays in uproot.iterate({ip_path: "miniT"}, sorted(set(eff.eff_branches + FakeRate.rate_branches)), step_size=step_size):
+        eff.fill_efficiency(arrays, eff_hists)
+        FakeRate.fill_rates(arrays, rate_hists)
+        n_events += len(arrays)
+
+    eff_output, rates_output = output_dirs(ip_path, eff_dir, rates_dir)
+    eff.save_plots(eff_hists, eff_output)
+    FakeRate.save_plots(rate_hists, rates_output)
+    return ip_path, n_events, time.time() - start
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Signal grid efficiency and fake rate script')
+    parser.add_argument('-i', action="store", dest="ip_files", nargs="+", required=True)
+    parser.add_argument('--eff-dir', action="store", dest="eff_dir", default="output_eff_plot")
+    parser.add_argument('--rates-dir', action="store", dest="rates_dir", default="output_fake_plot")
+    parser.add_argument('-j', action="store", dest="n_workers", default=os.cpu_count(), type=int)
+    parser.add_argument('-s', action="store", dest="step_size", default="100 MB")
+
+    args = parser.parse_args()
+    # the output directories are named after the DSID, check every file name before starting the workers
+    no_dsid = [ip_path for ip_path in args.ip_files if find_dsid(ip_path) is None]
+    if no_dsid:
+        parser.error(f"no 6 digit DSID in the file name of {', '.join(no_dsid)}")
+    # largest files first so the longest job starts straight away
+    ip_files = sorted(args.ip_files, key=os.path.getsize, reverse=True)
+
+    start = time.time()
+    total_events = 0
+    # spawn rather than fork so each worker starts its own ROOT
+    with ProcessPoolExecutor(max_workers=min(args.n_workers, len(ip_files)), mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(process_file, ip_path, args.eff_dir, args.rates_dir, args.step_size) for ip_path in ip_files]
+        for future in as_completed(futures):
+            ip_path, n_events, seconds = future.result()
+            total_events += n_events
+            print(f"{os.path.basename(ip_path)}: {n_events} events in {seconds:.1f}s : {n_events/seconds:.0f} events/s")
+    elapsed = time.time() - start
+    print(f"Processed {len(ip_files)} files, {total_events} events in {elapsed:.1f}s : {total_events/elapsed:.0f} events/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+'''
+Description: Apply a named preselection from common/selections.py to a list of ntuples and write slim, compressed copies.
+    Each input file is skimmed in its own process with one RDataFrame pass that also counts the entries and sum of
+    weights before and after the cut. The histograms stored next to the tree (e.g. the cutflows) are copied over and
+    a manifest skim_manifest.json records the provenance of every output.
+Example running script, keep only the LJjet1 and event level branches of the files passing the ljet preselection
+python3 skim.py -i /data/vbfskim/frvz_vbf_*.root /data/vbfskim/wjets_strong_sh227.root -o vbfljetskim/ -p ljet -b "LJjet1_*" "nLJ*" "scale1fb" "intLumi" "eventNumber" -j 8
+'''
+
+# IMPORTS ===========================================================================================================
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import argparse, fnmatch, json, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from selections import PRESELECTIONS
+
+
+def copy_histograms(ip_path, op_path):
+    # copy all the histograms in the original file
+    import ROOT
+    ip_tfile = ROOT.TFile.Open(ip_path, "READ")
+    op_tfile = ROOT.TFile(op_path, "update")
+    histos = [key.GetName() for key in ip_tfile.GetListOfKeys() if key.GetClassName()[:2]=="TH"]
+    for x in histos:
+        op_tfile.WriteTObject(ip_tfile.Get(x))
+    op_tfile.Close()
+    ip_tfile.Close()
+
+
+def skim_file(ip_path, op_path, tree_name, cut, branch_patterns, weight, compression, level):
+    # runs in a worker process, returns the manifest entry of this file
+    import ROOT
+    start = time.time()
+    df = ROOT.RDataFrame(tree_name, ip_path)
+    branches = [str(column) for column in df.GetColumnNames()]
+    if branch_patterns:
+        branches = [branch for branch in branches if any(fnmatch.fnmatch(branch, pattern) for pattern in branch_patterns)]
+
+    df = df.Define("skim_weight", weight)
+    entries_in, sumw_in = df.Count(), df.Sum("skim_weight")
+    skimmed = df.Filter(cut, "preselection")
+    entries_out, sumw_out = skimmed.Count(), skimmed.Sum("skim_weight")
+
+    options = ROOT.RDF.RSnapshotOptions()
+    options.fCompressionAlgorithm = getattr(ROOT.RCompressionSetting.EAlgorithm, "k" + compression.upper())
+    options.fCompressionLevel = level
+    # the snapshot runs the event loop, the counts and sums above are filled in the same pass
+    skimmed.Snapshot(tree_name, op_path, branches, options)
+    copy_histograms(ip_path, op_path)
+
+    return {
+        "input": os.path.abspath(ip_path),
+        "input_size": os.path.getsize(ip_path),
+        "input_mtime": os.path.getmtime(ip_path),
+        "output": os.path.abspath(op_path),
+        "output_size": os.path.getsize(op_path),
+        "entries_in": entries_in.GetValue(),
+        "entries_out": entries_out.GetValue(),
+        "sumw_in": sumw_in.GetValue(),
+        "sumw_out": sumw_out.GetValue(),
+        "branches": len(branches),
+        "seconds": time.time() - start,
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Preselection skim script')
+    parser.add_argument('-i', action="store", dest="ip_files", nargs="+")
+    parser.add_argument('-o', action="store", dest="op_dir", required=True)
+    parser.add_argument('-t', action="store", dest="tree_name", default="miniT")
+    parser.add_argument('-p', action="store", dest="preselection", default="ljet", choices=sorted(PRESELECTIONS))
+    # branches to keep, shell style patterns, all branches if not given
+    parser.add_argument('-b', action="store", dest="branches", nargs="*", default=[])
+    parser.add_argument('-w', action="store", dest="weight", default="scale1fb*intLumi")
+    parser.add_argument('-c', action="store", dest="compression", default="zstd", choices=["zstd", "lz4"])
+    parser.add_argument('-l', action="store", dest="level", default=5, type=int)
+    parser.add_argument('-j', action="store", dest="n_workers", default=os.cpu_count(), type=int)
+
+    args = parser.parse_args()
+    cut = PRESELECTIONS[args.preselection]
+    # outputs keep the input file names, writing them next to the inputs would overwrite files still being read
+    input_dirs = {os.path.dirname(os.path.realpath(ip_path)) for ip_path in args.ip_files}
+    if os.path.realpath(args.op_dir) in input_dirs:
+        parser.error(f"-o {args.op_dir} is the directory of an input file, choose a different output directory")
+    os.makedirs(args.op_dir, exist_ok=True)
+    op_paths = [os.path.join(args.op_dir, os.path.basename(ip_path)) for ip_path in args.ip_files]
+
+    start = time.time()
+    # spawn rather than fork so each worker starts its own ROOT
+    with ProcessPoolExecutor(max_workers=min(args.n_workers, len(args.ip_files)), mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(skim_file, ip_path, op_path, args.tree_name, cut, args.branches, args.weight, args.compression, args.level)
+                   for ip_path, op_path in zip(args.ip_files, op_paths)]
+        files = [future.result() for future in futures]
+
+    for entry in files:
+        print(f"{os.path.basename(entry['input'])}: {entry['entries_out']}/{entry['entries_in']} entries, "
+              f"{entry['output_size']/1e6:.1f}/{entry['input_size']/1e6:.1f} MB, {entry['branches']} branches, {entry['seconds']:.1f}s")
+    size_in = sum(entry['input_size'] for entry in files)
+    size_out = sum(entry['output_size'] for entry in files)
+    print(f"Skimmed {len(files)} files in {time.time() - start:.1f}s, {size_in/1e6:.1f} MB -> {size_out/1e6:.1f} MB")
+
+    manifest = {
+        "preselection": args.preselection,
+        "cut": cut,
+        "tree": args.tree_name,
+        "branches": args.branches,
+        "weight": args.weight,
+        "compression": f"{args.compression}:{args.level}",
+        "files": files,
+    }
+    with open(os.path.join(args.op_dir, "skim_manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
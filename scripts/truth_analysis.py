@@ -1,8 +1,20 @@
 import ROOT
 import os
-import math
-import re
-from ROOT import TFile, TCanvas, TLorentzVector, gStyle
+import sys
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import uproot
+from ROOT import TFile, gStyle
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import truth
+import histograms
+import executor
+import journal
+
+# Auto-ranged histograms end at this quantile of the data (times a headroom) rather than at the largest value
+range_quantile = 0.999
 
 def add_overflow_to_last_bin(hist):
 
@@ -13,103 +25,84 @@ def add_overflow_to_last_bin(hist):
         hist.SetBinContent(num_bins, last_bin_content + overflow_content)
         hist.SetBinContent(num_bins + 1, 0) # Clear the overflow bin
 
-input_base_dir = '/Users/sirawitsae/Desktop/project/DarkPhoton/vbfskim/'
-# This will process all 'frvz_' files found in the directory
-input_file_paths = [os.path.join(input_base_dir, f) for f in os.listdir(input_base_dir) if f.startswith('frvz_') and f.endswith('.root')]
-
-if not input_file_paths:
-    print(f"Error: No signal files ('frvz_*.root') found in {input_base_dir}")
-    exit()
-
-for path in input_file_paths:
+def output_paths(path):
+    # output_truth_<name>/histograms_<name>.root for <name>.root
+    base_name = os.path.basename(path).split('.')[0]
+    outputDir = f"output_truth_{base_name}"
+    return outputDir, os.path.join(outputDir, f"histograms_{base_name}.root")
+
+def journal_path(path):
+    # chunk checkpoints of an unfinished file, removed once its histograms are written
+    return os.path.join(output_paths(path)[0], "journal.json")
+
+def is_up_to_date(path):
+    # the histogram file was written after the input last changed, and not by a run that was cut short
+    outputRootPath = output_paths(path)[1]
+    return os.path.exists(outputRootPath) and os.path.getmtime(outputRootPath) > os.path.getmtime(path) and not os.path.exists(journal_path(path))
+
+def truth_chunk(arrays):
+    # one entry range, run by executor.run and checkpointed in the file's journal
+    # Fixed ranges are filled straight away, the others go to bounded fine-grained accumulators first
+    hists = {
+        'eta': ROOT.TH1F("dp_eta", "dark photon eta; #eta; Events", 100, -5, 5),
+        'phi': ROOT.TH1F("dp_phi", "dark photon phi; #phi; Events", 100, -3.2, 3.2),
+        'lxy': ROOT.TH1F("dp_lxy", "dark photon Lxy; Lxy [mm]; Events", 100, 0, 10000), # Fixed range of 10 meters
+        'acc': {key: histograms.FineHistogram() for key in ('pt', 'm', 'lz', 'ctau', 'deltaR')},
+        'acc_deltaR_vs_2mPt': histograms.FineHistogram(ndim=2, precision_bits=8),
+        'n_events': len(arrays),
+    }
+    acc = hists['acc']
+    # Dark photon observables for the whole range at once, daughters joined by barcode in truth.dark_photons
+    dps = truth.dark_photons(arrays)
+    two = dps['n_daughters'] == 2
+    has_approx = two & (dps['pt'] > 0)
+    truth.fill(hists['eta'], dps['eta']); truth.fill(hists['phi'], dps['phi']); truth.fill(hists['lxy'], dps['lxy'])
+    acc['pt'].fill(dps['pt']); acc['m'].fill(dps['m']); acc['lz'].fill(dps['lz'])
+    acc['ctau'].fill(dps['ctau'][dps['p'] > 0])
+    acc['deltaR'].fill(dps['deltaR'][two])
+    hists['acc_deltaR_vs_2mPt'].fill(dps['approx_deltaR'][has_approx], dps['deltaR'][has_approx])
+    return hists
+
+def analyse_file(path, entries_per_chunk=200000, n_workers=1, progress=True):
+    # runs in a worker process, returns (file, events, seconds)
+    ROOT.gROOT.SetBatch(True)
+    start = time.time()
     print("-" * 50)
     print(f"Processing file: {path}")
 
-    myfile = TFile.Open(path, "READ")
-    tree = myfile.Get("miniT")
-    if not tree:
+    with uproot.open(path) as f:
+        n_entries = f["miniT"].num_entries if "miniT" in f else None
+    if n_entries is None:
         print(f"Warning: TTree 'miniT' not found in {path}. Skipping.")
-        continue
+        return path, 0, time.time() - start
+    if n_entries == 0:
+        print(f"Warning: TTree 'miniT' in {path} is empty. Skipping.")
+        return path, 0, time.time() - start
 
-    print("Pass 1: Collecting data to determine histogram ranges...")
-    all_values = {
-        'pt': [], 'eta': [], 'phi': [], 'm': [], 'lxy': [], 'lz': [],
-        'ctau': [], 'deltaR': [], 'approx_deltaR': []
-    }
-    for i in range(tree.GetEntries()):
-        tree.GetEntry(i)
-        dark_photon_indices = [j for j, pdgId in enumerate(tree.truthPdgId) if pdgId == 3000001]
-        if not dark_photon_indices: continue
-
-        for dp_idx in dark_photon_indices:
-            p4 = TLorentzVector()
-            p4.SetPtEtaPhiE(tree.truthPt[dp_idx] * 0.001, tree.truthEta[dp_idx], tree.truthPhi[dp_idx], tree.truthE[dp_idx] * 0.001)
-
-            all_values['pt'].append(p4.Pt())
-            all_values['eta'].append(p4.Eta())
-            all_values['phi'].append(p4.Phi())
-            all_values['m'].append(p4.M())
-
-            dx = tree.truthDecayVtx_x[dp_idx]
-            dy = tree.truthDecayVtx_y[dp_idx]
-            dz = tree.truthDecayVtx_z[dp_idx]
-            lxy = math.sqrt(dx**2 + dy**2)
-            decay_length_3d = math.sqrt(dx**2 + dy**2 + dz**2)
-
-            all_values['lxy'].append(lxy)
-            all_values['lz'].append(abs(dz))
-
-            if p4.P() > 0:
-                all_values['ctau'].append((decay_length_3d / p4.P()) * p4.M())
-
-            dp_barcode = tree.truthBarcode[dp_idx]
-            daughters = []
-            for k in range(len(tree.childPdgId)):
-                if tree.childMomBarcode[k] == dp_barcode:
-                    daughter_p4 = TLorentzVector()
-                    daughter_p4.SetPtEtaPhiM(tree.childPt[k] * 0.001, tree.childEta[k], tree.childPhi[k], 0)
-                    daughters.append(daughter_p4)
-
-            if len(daughters) == 2:
-                deltaR = daughters[0].DeltaR(daughters[1])
-                all_values['deltaR'].append(deltaR)
-                if p4.Pt() > 0:
-                    all_values['approx_deltaR'].append((2 * p4.M()) / p4.Pt())
+    outputDir, outputRootPath = output_paths(path)
+    os.makedirs(outputDir, exist_ok=True)
+
+    print("Reading chunks once and filling histograms...")
+    # a restarted job picks up the chunks already in the journal
+    hists = executor.run(truth_chunk, [path], truth.truth_branches, entries_per_chunk=entries_per_chunk, n_workers=n_workers,
+                         journal=journal_path(path), progress=progress, label=os.path.basename(path))
+    n_events = hists['n_events']
+    h_dp_eta, h_dp_phi, h_dp_lxy = hists['eta'], hists['phi'], hists['lxy']
+    acc, acc_deltaR_vs_2mPt = hists['acc'], hists['acc_deltaR_vs_2mPt']
 
     # Create Histograms 
-    base_name = os.path.basename(path).split('.')[0]
-    outputDir = f"output_truth_{base_name}"
-    os.makedirs(outputDir, exist_ok=True)
-    outputRootPath = os.path.join(outputDir, f"histograms_{base_name}.root")
     outputFile = TFile(outputRootPath, "RECREATE")
-
-    h_dp_pt = ROOT.TH1F("dp_pt", "dark photon pt; pT [GeV]; Events", 100, 0, max(all_values['pt'])*1.1 if all_values['pt'] else 500)
-    h_dp_eta = ROOT.TH1F("dp_eta", "dark photon eta; #eta; Events", 100, -5, 5)
-    h_dp_phi = ROOT.TH1F("dp_phi", "dark photon phi; #phi; Events", 100, -3.2, 3.2)
-    h_dp_m = ROOT.TH1F("dp_m", "dark photon mass; Mass [GeV]; Events", 100, 0, max(all_values['m'])*1.2 if all_values['m'] else 1)
-    h_dp_lxy = ROOT.TH1F("dp_lxy", "dark photon Lxy; Lxy [mm]; Events", 100, 0, 10000) # Fixed range of 10 meters
-    h_dp_lz = ROOT.TH1F("dp_lz", "dark photon Lz; Lz [mm]; Events", 100, 0, max(all_values['lz'])*1.1) 
-    h_dp_ctau = ROOT.TH1F("dp_ctau", "dark photon ctau; c#tau [mm]; Events", 100, 0, max(all_values['ctau'])*1.1 if all_values['ctau'] else 100)
-    h_dp_deltaR = ROOT.TH1F("dp_deltaR", "dark photon #DeltaR; #DeltaR; Events", 100, 0, max(all_values['deltaR'])*1.1 if all_values['deltaR'] else 1.0)
-    h_deltaR_vs_2mPt = ROOT.TH2F("deltaR_vs_2mPt", "True #DeltaR vs. 2m/p_{T} Approx.;Approximation (2m/p_{T});True #DeltaR",
-                                 100, 0, max(all_values['approx_deltaR'])*1.1 if all_values['approx_deltaR'] else 1.0,
-                                 100, 0, max(all_values['deltaR'])*1.1 if all_values['deltaR'] else 1.0)
-
-    print("Pass 2: Filling histograms...")
-    for i in range(len(all_values['pt'])):
-        h_dp_pt.Fill(all_values['pt'][i]); h_dp_eta.Fill(all_values['eta'][i]);
-        h_dp_phi.Fill(all_values['phi'][i]); h_dp_m.Fill(all_values['m'][i]);
-        h_dp_lxy.Fill(all_values['lxy'][i]); h_dp_lz.Fill(all_values['lz'][i]);
-        h_dp_ctau.Fill(all_values['ctau'][i]);
-
-    for i in range(len(all_values['deltaR'])):
-        h_dp_deltaR.Fill(all_values['deltaR'][i])
-        h_deltaR_vs_2mPt.Fill(all_values['approx_deltaR'][i], all_values['deltaR'][i])
-
-    add_overflow_to_last_bin(h_dp_pt)
+    outputFile.cd()
+    h_dp_pt = acc['pt'].to_th1("dp_pt", "dark photon pt; pT [GeV]; Events", 100, quantile=range_quantile, headroom=1.1, default_max=500, overflow_to_last_bin=True)
+    h_dp_m = acc['m'].to_th1("dp_m", "dark photon mass; Mass [GeV]; Events", 100, quantile=range_quantile, headroom=1.2, default_max=1)
+    h_dp_lz = acc['lz'].to_th1("dp_lz", "dark photon Lz; Lz [mm]; Events", 100, quantile=range_quantile, headroom=1.1, default_max=1, overflow_to_last_bin=True)
+    h_dp_ctau = acc['ctau'].to_th1("dp_ctau", "dark photon ctau; c#tau [mm]; Events", 100, quantile=range_quantile, headroom=1.1, default_max=100, overflow_to_last_bin=True)
+    h_dp_deltaR = acc['deltaR'].to_th1("dp_deltaR", "dark photon #DeltaR; #DeltaR; Events", 100, quantile=range_quantile, headroom=1.1, default_max=1.0)
+    h_deltaR_vs_2mPt = acc_deltaR_vs_2mPt.to_th2("deltaR_vs_2mPt", "True #DeltaR vs. 2m/p_{T} Approx.;Approximation (2m/p_{T});True #DeltaR",
+                                                 (100, 100), quantile=range_quantile, headroom=(1.1, 1.1), default_max=(1.0, 1.0))
+
+    # pt, lz and ctau fold their overflow in to_th1, which keeps the per-entry mean and RMS
     add_overflow_to_last_bin(h_dp_lxy)
-    add_overflow_to_last_bin(h_dp_lz)
-    add_overflow_to_last_bin(h_dp_ctau)
 
 
     outputFile.cd()
@@ -146,7 +139,50 @@ for path in input_file_paths:
     print(f"\nAll plots saved in {outputDir}")
 
     outputFile.Close()
-    myfile.Close()
+    journal.remove(journal_path(path))
+    return path, n_events, time.time() - start
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Dark photon truth distributions for every frvz_ signal file')
+    parser.add_argument('-d', action="store", dest="input_base_dir", default='/Users/sirawitsae/Desktop/project/DarkPhoton/vbfskim/')
+    parser.add_argument('-j', action="store", dest="n_workers", default=os.cpu_count(), type=int)
+    parser.add_argument('-c', action="store", dest="chunk_entries", default=200000, type=int, help="entries per checkpointed chunk")
+    parser.add_argument('-f', action="store_true", dest="force", help="rerun files whose outputs are already up to date")
+
+    args = parser.parse_args()
+    # This will process all 'frvz_' files found in the directory
+    input_file_paths = [os.path.join(args.input_base_dir, f) for f in os.listdir(args.input_base_dir) if f.startswith('frvz_') and f.endswith('.root')]
+
+    if not input_file_paths:
+        print(f"Error: No signal files ('frvz_*.root') found in {args.input_base_dir}")
+        exit()
+
+    # Only files whose outputs are older than the input, largest first so the longest job starts straight away
+    todo = sorted([path for path in input_file_paths if args.force or not is_up_to_date(path)], key=os.path.getsize, reverse=True)
+    print(f"{len(input_file_paths) - len(todo)} of {len(input_file_paths)} files already up to date, processing {len(todo)}")
+
+    start = time.time()
+    summary = []
+    if todo:
+        # cores left over when there are fewer files than workers go to the chunks of each file
+        chunk_workers = max(args.n_workers // len(todo), 1)
+        progress = journal.Progress(sum(os.path.getsize(path) for path in todo), f"{len(todo)} files")
+        # spawn rather than fork so each worker starts its own ROOT
+        with ProcessPoolExecutor(max_workers=max(min(args.n_workers, len(todo)), 1), mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(analyse_file, path, args.chunk_entries, chunk_workers, len(todo) == 1) for path in todo]
+            for future in as_completed(futures):
+                summary.append(future.result())
+                progress.update(os.path.getsize(summary[-1][0]), events=summary[-1][1])
+        progress.finish()
+    elapsed = time.time() - start
 
-print("-" * 50)
-print("All files processed.")
\ No newline at end of file
+    print("-" * 50)
+    total_events = 0
+    for path, n_events, seconds in sorted(summary, key=lambda result: result[2], reverse=True):
+        total_events += n_events
+        print(f"{os.path.basename(path)}: {n_events} events in {seconds:.1f}s : {n_events/max(seconds, 1e-9):.0f} events/s")
+    print(f"All files processed: {len(summary)} files, {total_events} events in {elapsed:.1f}s : {total_events/max(elapsed, 1e-9):.0f} events/s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+import os, sys
+
+# the scripts import the shared helpers by path, do the same for the tests
+repo = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for directory in ('common', 'TMVA'):
+    sys.path.insert(0, os.path.join(repo, directory))
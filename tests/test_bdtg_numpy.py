@@ -0,0 +1,113 @@
+from array import array
+
+import numpy as np
+import pytest
+
+from bdtg_numpy import BDTGForest
+
+# two trees over x (IVar 0) and y (IVar 1)
+# tree 0: x >= 0.5 goes right (cType 1) to a y split with cType 0, where y >= 2 goes LEFT
+# tree 1: a single y >= 1 split
+WEIGHTS_XML = """<?xml version="1.0"?>
+<MethodSetup Method="BDT::BDTG">
+  <Options>
+    <Option name="BoostType" modified="Yes">Grad</Option>
+  </Options>
+  <Variables NVar="2">
+    <Variable VarIndex="1" Expression="y"/>
+    <Variable VarIndex="0" Expression="x"/>
+  </Variables>
+  <Transformations NTransformations="0"/>
+  <Weights NTrees="2" AnalysisType="1">
+    <BinaryTree type="DecisionTree" boostWeight="1" itree="0">
+      <Node pos="s" depth="0" NCoef="0" IVar="0" Cut="0.5" cType="1" res="0" rms="0" purity="0.5" nType="0">
+        <Node pos="l" depth="1" NCoef="0" IVar="-1" Cut="0" cType="1" res="-0.3" rms="0" purity="0.2" nType="-1"/>
+        <Node pos="r" depth="1" NCoef="0" IVar="1" Cut="2" cType="0" res="0" rms="0" purity="0.6" nType="0">
+          <Node pos="l" depth="2" NCoef="0" IVar="-1" Cut="0" cType="1" res="0.1" rms="0" purity="0.5" nType="1"/>
+          <Node pos="r" depth="2" NCoef="0" IVar="-1" Cut="0" cType="1" res="0.7" rms="0" purity="0.9" nType="1"/>
+        </Node>
+      </Node>
+    </BinaryTree>
+    <BinaryTree type="DecisionTree" boostWeight="1" itree="1">
+      <Node pos="s" depth="0" NCoef="0" IVar="1" Cut="1" cType="1" res="0" rms="0" purity="0.5" nType="0">
+        <Node pos="l" depth="1" NCoef="0" IVar="-1" Cut="0" cType="1" res="-0.2" rms="0" purity="0.3" nType="-1"/>
+        <Node pos="r" depth="1" NCoef="0" IVar="-1" Cut="0" cType="1" res="0.25" rms="0" purity="0.7" nType="1"/>
+      </Node>
+    </BinaryTree>
+  </Weights>
+</MethodSetup>
+"""
+
+
+@pytest.fixture
+def forest(tmp_path):
+    path = tmp_path / "BDTG.weights.xml"
+    path.write_text(WEIGHTS_XML)
+    return BDTGForest.from_xml(str(path))
+
+
+def test_parse(forest):
+    # columns follow VarIndex, not the order in the file
+    assert forest.variables == ["x", "y"]
+    assert forest.max_depth == 2
+    assert len(forest.roots) == 2
+
+
+def test_tree_walk_and_output(forest):
+    x = np.array([[0.2, 5.0],   # left leaf -0.3, right leaf 0.25
+                  [0.7, 3.0],   # y >= 2 with cType 0 goes left: 0.1, then 0.25
+                  [0.7, 1.0],   # y < 2 with cType 0 goes right: 0.7, y >= 1: 0.25
+                  [0.5, 0.5]])  # cut values go right for cType 1: 0.7, then -0.2
+    total = np.array([-0.3 + 0.25, 0.1 + 0.25, 0.7 + 0.25, 0.7 - 0.2], dtype=np.float32).astype(np.float64)
+    expected = 2.0/(1.0+np.exp(-2.0*total))-1
+    np.testing.assert_allclose(forest.evaluate(x), expected, rtol=1e-6)
+    # batches and threads give the same answer
+    np.testing.assert_array_equal(forest.evaluate(x, batch_size=1, n_threads=2), forest.evaluate(x))
+
+
+def test_rejects_other_boost_types(tmp_path):
+    path = tmp_path / "ada.weights.xml"
+    path.write_text(WEIGHTS_XML.replace(">Grad<", ">AdaBoost<"))
+    with pytest.raises(NotImplementedError):
+        BDTGForest.from_xml(str(path))
+
+
+def test_matches_evaluate_mva(tmp_path, monkeypatch):
+    ROOT = pytest.importorskip("ROOT")
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(2)
+    n = 2000
+    data = {'x': rng.normal(0, 1, 2*n), 'y': rng.normal(0, 1, 2*n)}
+    data['x'][:n] += 1
+    data['y'][:n] -= 0.5
+    ROOT.RDF.FromNumpy(data).Define("is_sig", f"rdfentry_ < {n}").Snapshot("t", "train.root")
+
+    # a small BDTG trained by TMVA itself, so the weights file is exactly what TMVA writes
+    input_file = ROOT.TFile.Open("train.root")
+    tree = input_file.Get("t")
+    output_file = ROOT.TFile.Open("tmva.root", "RECREATE")
+    factory = ROOT.TMVA.Factory("test", output_file, "!V:Silent:!DrawProgressBar:AnalysisType=Classification")
+    loader = ROOT.TMVA.DataLoader("dataset")
+    loader.AddVariable("x", "F")
+    loader.AddVariable("y", "F")
+    loader.AddSignalTree(tree, 1.0)
+    loader.AddBackgroundTree(tree, 1.0)
+    loader.PrepareTrainingAndTestTree(ROOT.TCut("is_sig"), ROOT.TCut("!is_sig"), "SplitMode=Random:NormMode=NumEvents:!V")
+    factory.BookMethod(loader, ROOT.TMVA.Types.kBDT, "BDTG", "!H:!V:NTrees=20:BoostType=Grad:Shrinkage=0.1:MaxDepth=3:nCuts=20")
+    factory.TrainAllMethods()
+    output_file.Close()
+    weights_file = str(tmp_path / "dataset" / "weights" / "test_BDTG.weights.xml")
+
+    reader = ROOT.TMVA.Reader("!Color:Silent")
+    x, y = array('f', [0]), array('f', [0])
+    reader.AddVariable("x", x)
+    reader.AddVariable("y", y)
+    reader.BookMVA("BDTG", weights_file)
+
+    events = np.column_stack([data['x'][::20], data['y'][::20]]).astype(np.float32)
+    expected = []
+    for event in events:
+        x[0], y[0] = event
+        expected.append(reader.EvaluateMVA("BDTG"))
+    forest = BDTGForest.from_xml(weights_file)
+    np.testing.assert_allclose(forest.evaluate(events), expected, atol=1e-5)
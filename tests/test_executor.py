@@ -0,0 +1,57 @@
+import itertools
+
+import numpy as np
+import pytest
+
+import executor
+
+
+class Counter:
+    # stands in for a histogram with Add
+    def __init__(self, n):
+        self.n = n
+
+    def Add(self, other):
+        self.n += other.n
+
+
+def reduce(order, results):
+    reduction = executor.TreeReduction()
+    for index in order:
+        reduction.add(index, results[index])
+    return reduction.result()
+
+
+def test_merge_nested_results():
+    a = {'h': Counter(1), 'pair': (1, np.array([1.0, 2.0])), 'lists': [2, 3]}
+    b = {'h': Counter(4), 'pair': (2, np.array([0.5, 0.5])), 'lists': [1, 1], 'new': 7}
+    merged = executor.merge(a, b)
+    assert merged['h'].n == 5 and merged['pair'][0] == 3 and merged['lists'] == [3, 4] and merged['new'] == 7
+    np.testing.assert_array_equal(merged['pair'][1], [1.5, 2.5])
+
+
+@pytest.mark.parametrize('n', [1, 2, 5, 8])
+def test_out_of_order_chunks_merge_in_chunk_order(n):
+    # string concatenation is not commutative, so any order mix-up shows
+    results = [chr(ord('a') + i) for i in range(n)]
+    for order in itertools.islice(itertools.permutations(range(n)), 200):
+        assert reduce(order, results) == ''.join(results)
+
+
+def test_out_of_order_float_sums_are_bit_identical():
+    rng = np.random.default_rng(2)
+    results = list(rng.normal(0, 1e8, 13) * rng.uniform(0, 1e-8, 13))
+    expected = reduce(range(13), results)
+    for _ in range(50):
+        assert reduce(rng.permutation(13), results) == expected
+
+
+def test_no_chunks():
+    assert executor.TreeReduction().result() is None
+
+
+def test_run_without_entries():
+    pytest.importorskip("uproot")
+    assert executor.run(None, [], [], empty=dict, progress=False) == {}
+    with pytest.raises(ValueError, match="no entries"):
+        executor.run(None, [], [], progress=False)
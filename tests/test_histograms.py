@@ -0,0 +1,59 @@
+import numpy as np
+
+import histograms
+
+
+def test_fill_matches_a_direct_histogram_in_the_final_range():
+    rng = np.random.default_rng(3)
+    x = np.concatenate([rng.exponential(2.0, 5000), rng.normal(-1, 0.5, 500), [np.nan, np.inf]])
+    acc = histograms.FineHistogram()
+    for chunk in np.array_split(x, 3):
+        acc.fill(chunk)
+    finite = x[np.isfinite(x)]
+    assert acc.counts.sum() == len(finite) and acc.skipped == 2
+    np.testing.assert_allclose(acc.sums.sum(axis=1), [finite.sum(), (finite**2).sum()], rtol=1e-12)
+    low, high, width = acc.axis_range(0, 40, -3.3, 0.99, 1.1, 1.0)
+    bins = acc.final_bins(0, 40, low, width)
+    contents = np.bincount(bins, weights=acc.counts, minlength=42)
+    np.testing.assert_array_equal(contents[1:41], np.histogram(finite, bins=np.linspace(low, high, 41))[0])
+    assert contents[0] == np.count_nonzero(finite < low) and contents[41] == np.count_nonzero(finite >= high)
+
+
+def test_outlier_does_not_stretch_the_range():
+    rng = np.random.default_rng(5)
+    x = rng.exponential(10, 1000000)
+    acc = histograms.FineHistogram()
+    acc.fill(x)
+    before = acc.axis_range(0, 100, 0.0, 0.999, 1.0, 1.0)
+    acc.fill([1e6])
+    low, high, width = acc.axis_range(0, 100, 0.0, 0.999, 1.0, 1.0)
+    assert (low, high, width) == before
+    quantile = np.quantile(x, 0.999)
+    assert quantile <= high < quantile * (1 + 100 / 2**acc.precision_bits) + 2 * width
+    assert np.count_nonzero(acc.final_bins(0, 100, low, width) == 101) > 0
+
+
+def test_fine_bins_respect_half_open_edges():
+    acc = histograms.FineHistogram(precision_bits=2, min_width_exp=-4)
+    np.testing.assert_array_equal(acc.fine_edges(np.array([-1.0, -0.75, -0.0, 1.0, 1.2, 5.0])), [-1.0, -0.75, 0.0, 1.0, 1.0, 5.0])
+    np.testing.assert_array_equal(acc.fine_width(np.array([-1.0, 1.0, 4.0, 0.01])), [0.125, 0.25, 1.0, 0.0625])
+
+
+def test_merge_matches_single_fill_2d():
+    rng = np.random.default_rng(4)
+    x, y = rng.normal(0, 1, 4000), rng.exponential(5, 4000)
+    whole = histograms.FineHistogram(ndim=2, precision_bits=6)
+    whole.fill(x, y)
+    a, b = histograms.FineHistogram(ndim=2, precision_bits=6), histograms.FineHistogram(ndim=2, precision_bits=6)
+    a.fill(x[:1000], y[:1000]); b.fill(x[1000:], y[1000:])
+    a.merge(b)
+    np.testing.assert_array_equal(a.edges, whole.edges)
+    np.testing.assert_array_equal(a.counts, whole.counts)
+    np.testing.assert_allclose(a.sums, whole.sums, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(a.sums.sum(axis=1), [x.sum(), (x**2).sum(), y.sum(), (y**2).sum(), (x*y).sum()], rtol=1e-9)
+
+
+def test_stats_of_in_range_bins():
+    acc = histograms.FineHistogram()
+    acc.fill([0.5, 1.5, 1.5, 7.0])
+    np.testing.assert_allclose(acc.stats(acc.edges[:, 0] < 2), [3, 3, 3.5, 0.25 + 2*2.25])
@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+
+import journal
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    path = tmp_path / "input.root"
+    path.write_bytes(b"0" * 100)
+    return [str(path)]
+
+
+def test_interrupted_run_resumes(tmp_path, inputs):
+    path = str(tmp_path / "job.journal.json")
+    key = journal.job_key(inputs, tree="miniT", entries_per_chunk=10)
+    done = journal.Journal(path, key)
+    done.finish(0, {'n': 1}, entries=10)
+    done.finish(2, [3], entries=10)
+    del done  # the job stops here
+
+    resumed = journal.Journal(path, journal.job_key(inputs, tree="miniT", entries_per_chunk=10))
+    assert [index for index in range(4) if resumed.done(index)] == [0, 2]
+    assert resumed.load(0) == {'n': 1} and resumed.load(2) == [3]
+    assert resumed.chunks[2]['entries'] == 10
+
+
+def test_changed_settings_start_over(tmp_path, inputs):
+    path = str(tmp_path / "job.journal.json")
+    journal.Journal(path, journal.job_key(inputs, entries_per_chunk=10)).finish(0, 1)
+    assert not journal.Journal(path, journal.job_key(inputs, entries_per_chunk=20)).done(0)
+
+
+@pytest.mark.parametrize('change', ['size', 'mtime'])
+def test_changed_input_invalidates(tmp_path, inputs, change):
+    path = str(tmp_path / "job.journal.json")
+    done = journal.Journal(path, journal.job_key(inputs))
+    done.finish(0, 'partial')
+    part = done.chunks[0]['file']
+    stat = os.stat(inputs[0])
+    if change == 'size':
+        with open(inputs[0], 'ab') as f:
+            f.write(b"1")
+        os.utime(inputs[0], ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    else:
+        os.utime(inputs[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    restarted = journal.Journal(path, journal.job_key(inputs))
+    assert not restarted.done(0) and not restarted.chunks
+    assert not os.path.exists(part) and not os.path.exists(path)
+
+
+def test_rewrite_is_atomic(tmp_path, inputs, monkeypatch):
+    path = str(tmp_path / "job.journal.json")
+    done = journal.Journal(path, journal.job_key(inputs))
+    done.finish(0, 'first')
+    assert not os.path.exists(path + '.tmp')
+
+    def crash(*args, **kwargs):
+        # the process dies half way through writing the new journal
+        args[1].write('{"key": "trunc')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(journal.json, 'dump', crash)
+    with pytest.raises(KeyboardInterrupt):
+        done.finish(1, 'second')
+    monkeypatch.undo()
+
+    with open(path) as f:
+        assert list(json.load(f)['chunks']) == ['0']
+    resumed = journal.Journal(path, journal.job_key(inputs))
+    assert resumed.done(0) and not resumed.done(1) and resumed.load(0) == 'first'
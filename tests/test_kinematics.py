@@ -0,0 +1,65 @@
+import numpy as np
+import awkward as ak
+import pytest
+
+import kinematics
+
+
+def test_delta_r_wraps_phi_numpy():
+    dr = kinematics.delta_r(np.array([0.0, 1.0]), np.array([3.0, 0.0]), np.array([0.0, 0.0]), np.array([-3.0, 0.0]))
+    np.testing.assert_allclose(dr, [2*np.pi - 6.0, 1.0])
+
+
+def test_delta_r_jagged():
+    eta1 = ak.Array([[0.0, 1.0], [], [0.5]])
+    phi1 = ak.Array([[3.0, 0.0], [], [0.0]])
+    dr = kinematics.delta_r(eta1, phi1, eta1 * 0, -phi1)
+    assert ak.to_list(ak.num(dr)) == [2, 0, 1]
+    np.testing.assert_allclose(ak.to_numpy(ak.flatten(dr)), [2*np.pi - 6.0, 1.0, 0.5])
+
+
+def test_mass_keeps_sign_and_pt_eta_phi_m_roundtrip():
+    # p = 3 at eta = 0: E = 5 gives m = 4, E = 3 with p = 5 gives m^2 = -16
+    v = kinematics.from_pt_eta_phi_e(np.array([3.0, 5.0]), np.zeros(2), np.zeros(2), np.array([5.0, 3.0]))
+    np.testing.assert_allclose(kinematics.mass(v), [4.0, -4.0])
+    w = kinematics.from_pt_eta_phi_m(np.array([3.0]), np.array([0.0]), np.array([0.0]), np.array([4.0]))
+    np.testing.assert_allclose(w['e'], [5.0])
+
+
+def test_mass_and_invariant_mass_jagged():
+    pt = ak.Array([[3.0], [3.0, 3.0]])
+    zero = pt * 0
+    v = kinematics.from_pt_eta_phi_e(pt, zero, zero, pt * 0 + 5.0)
+    np.testing.assert_allclose(ak.to_numpy(ak.flatten(kinematics.mass(v))), [4.0, 4.0, 4.0])
+    # two massless back to back 1 GeV particles make m = 2
+    a = kinematics.from_pt_eta_phi_m(np.array([1.0]), np.array([0.0]), np.array([0.0]), np.array([0.0]))
+    b = kinematics.from_pt_eta_phi_m(np.array([1.0]), np.array([0.0]), np.array([np.pi]), np.array([0.0]))
+    np.testing.assert_allclose(kinematics.invariant_mass(a, b), [2.0])
+
+
+def test_eta_closed_form_and_beam_axis():
+    v = {'px': np.array([3.0, 0.0, 0.0]), 'py': np.zeros(3), 'pz': np.array([4.0, 1.0, -1.0]), 'e': np.zeros(3)}
+    np.testing.assert_allclose(kinematics.eta(v), [np.log(3.0), 1e11, -1e11])
+    jagged = {key: ak.Array([list(value), []]) for key, value in v.items()}
+    np.testing.assert_allclose(ak.to_numpy(ak.flatten(kinematics.eta(jagged))), [np.log(3.0), 1e11, -1e11])
+
+
+def test_ctau_nan_for_zero_momentum():
+    ctau = kinematics.ctau(np.array([10.0, 10.0]), np.array([5.0, 0.0]), np.array([2.0, 2.0]))
+    assert ctau[0] == pytest.approx(4.0)
+    assert np.isnan(ctau[1])
+    jagged = kinematics.ctau(ak.Array([[10.0, 10.0], []]), ak.Array([[5.0, 0.0], []]), ak.Array([[2.0, 2.0], []]))
+    values = ak.to_numpy(ak.flatten(jagged))
+    assert values[0] == pytest.approx(4.0)
+    assert np.isnan(values[1])
+
+
+def test_decay_lengths():
+    assert kinematics.lxy(3.0, 4.0) == pytest.approx(5.0)
+    assert kinematics.decay_length(2.0, 3.0, 6.0) == pytest.approx(7.0)
+
+
+def test_matches_tlorentzvector():
+    pytest.importorskip("ROOT")
+    for name, difference in kinematics.compare_to_tlorentzvector(n=500).items():
+        assert difference < 1e-9, name
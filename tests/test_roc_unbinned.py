@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from roc_unbinned import unbinned_roc
+
+# signal 0.9 (w=1), 0.5 (w=2), 0.5 (w=1), background 0.5 (w=1), 0.1 (w=3), the nan entry is dropped
+sig_scores, sig_weights = np.array([0.9, 0.5, 0.5, np.nan]), np.array([1.0, 2.0, 1.0, 5.0])
+bkg_scores, bkg_weights = np.array([0.5, 0.1]), np.array([1.0, 3.0])
+
+
+def test_right_cut_with_tied_scores():
+    roc = unbinned_roc(sig_scores, sig_weights, bkg_scores, bkg_weights, rejections=(0.9, 0.75))
+    # score >= t: the three 0.5 entries are always cut together
+    np.testing.assert_allclose(roc['thresholds'], [np.inf, 0.9, 0.5, 0.1])
+    np.testing.assert_allclose(roc['eff_sig'], [0, 0.25, 1, 1])
+    np.testing.assert_allclose(roc['rej_bkg'], [1, 1, 0.75, 0])
+    assert roc['auc'] == pytest.approx(0.25 + 0.75 * (1 + 0.75) / 2)
+    np.testing.assert_allclose(roc['wp_eff_sig'], [0.25, 1.0])
+    np.testing.assert_allclose(roc['wp_threshold'], [0.9, 0.5])
+
+
+def test_left_cut():
+    roc = unbinned_roc(sig_scores, sig_weights, bkg_scores, bkg_weights, left_cut=True, rejections=(0.9,))
+    # score <= t
+    np.testing.assert_allclose(roc['thresholds'], [-np.inf, 0.1, 0.5, 0.9])
+    np.testing.assert_allclose(roc['eff_sig'], [0, 0, 0.75, 1])
+    np.testing.assert_allclose(roc['rej_bkg'], [1, 0.25, 0, 0])
+    assert roc['auc'] == pytest.approx(0.75 * 0.25 / 2)
+    np.testing.assert_allclose(roc['wp_eff_sig'], [0.0])
+
+
+@pytest.mark.parametrize("sig, bkg, name", [
+    ((np.array([]), np.array([])), (bkg_scores, bkg_weights), "signal"),
+    ((sig_scores, sig_weights), (np.array([np.nan, np.nan]), np.ones(2)), "background"),
+    ((sig_scores, np.zeros(4)), (bkg_scores, bkg_weights), "signal"),
+])
+def test_empty_sample_raises(sig, bkg, name):
+    with pytest.raises(ValueError, match=name):
+        unbinned_roc(*sig, *bkg)
+
+
+def test_infinite_scores_are_kept(capsys):
+    # the +inf signal entry passes every cut, the -inf background entry none, and the two tied +inf stay together
+    sig = np.array([np.inf, np.inf, 0.5, np.nan]), np.array([1.0, 1.0, 2.0, 5.0])
+    bkg = np.array([0.5, -np.inf]), np.array([1.0, 3.0])
+    roc = unbinned_roc(*sig, *bkg, rejections=(0.75,))
+    np.testing.assert_allclose(roc['thresholds'], [np.inf, np.inf, 0.5, -np.inf])
+    np.testing.assert_allclose(roc['eff_sig'], [0, 0.5, 1, 1])
+    np.testing.assert_allclose(roc['rej_bkg'], [1, 1, 0.75, 0])
+    assert "dropping 1 signal entries with a nan score" in capsys.readouterr().out
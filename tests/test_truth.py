@@ -0,0 +1,67 @@
+import math
+
+import awkward as ak
+import numpy as np
+
+import truth
+
+
+def synthetic_events(n_events=60, seed=7):
+    # a few dark photons per event with 0-3 daughters, barcodes reused across events, some other particles
+    rng = np.random.default_rng(seed)
+    events = {name: [] for name in truth.truth_branches}
+    for _ in range(n_events):
+        n_truth = rng.integers(0, 5)
+        barcodes = rng.choice([1, 2, 3, 10001, 200003, -5], size=n_truth, replace=False)
+        pdg = rng.choice([truth.DARK_PHOTON, 11, 13], size=n_truth)
+        children = [b for b in barcodes for _ in range(rng.integers(0, 4))] + [999] * rng.integers(0, 2)
+        rng.shuffle(children)
+        n_children = len(children)
+        columns = {
+            "truthPdgId": pdg, "truthBarcode": barcodes,
+            "truthPt": rng.uniform(0, 1e5, n_truth), "truthEta": rng.uniform(-3, 3, n_truth),
+            "truthPhi": rng.uniform(-np.pi, np.pi, n_truth), "truthE": rng.uniform(1e5, 3e5, n_truth),
+            "truthDecayVtx_x": rng.normal(0, 100, n_truth), "truthDecayVtx_y": rng.normal(0, 100, n_truth),
+            "truthDecayVtx_z": rng.normal(0, 100, n_truth),
+            "childMomBarcode": children, "childPt": rng.uniform(0, 5e4, n_children),
+            "childEta": rng.uniform(-3, 3, n_children), "childPhi": rng.uniform(-np.pi, np.pi, n_children),
+        }
+        for name, values in columns.items():
+            events[name].append(list(values))
+    return ak.zip({name: ak.Array(values) for name, values in events.items()}, depth_limit=1)
+
+
+def naive_daughters(arrays):
+    # the per dark photon scan of the child vector that dark_photons replaces
+    n_daughters, deltaR = [], []
+    for event in arrays.to_list():
+        for pdg, barcode in zip(event["truthPdgId"], event["truthBarcode"]):
+            if pdg != truth.DARK_PHOTON:
+                continue
+            daughters = [i for i, mother in enumerate(event["childMomBarcode"]) if mother == barcode]
+            n_daughters.append(len(daughters))
+            if len(daughters) == 2:
+                i, j = daughters
+                dphi = (event["childPhi"][i] - event["childPhi"][j] + math.pi) % (2*math.pi) - math.pi
+                deltaR.append(math.hypot(event["childEta"][i] - event["childEta"][j], dphi))
+            else:
+                deltaR.append(math.nan)
+    return np.array(n_daughters), np.array(deltaR)
+
+
+def test_daughter_join_matches_a_naive_loop():
+    arrays = synthetic_events()
+    dps = truth.dark_photons(arrays)
+    n_daughters, deltaR = naive_daughters(arrays)
+    assert len(n_daughters) > 20 and set(n_daughters) >= {0, 1, 2, 3}
+    np.testing.assert_array_equal(dps['n_daughters'], n_daughters)
+    np.testing.assert_allclose(dps['deltaR'], deltaR, rtol=1e-12, equal_nan=True)
+
+
+def test_dark_photon_kinematics():
+    arrays = synthetic_events(n_events=10)
+    dps = truth.dark_photons(arrays)
+    is_dp = arrays.truthPdgId == truth.DARK_PHOTON
+    np.testing.assert_allclose(dps['pt'], ak.to_numpy(ak.flatten(arrays.truthPt[is_dp])) * 1e-3)
+    np.testing.assert_allclose(dps['lz'], np.abs(ak.to_numpy(ak.flatten(arrays.truthDecayVtx_z[is_dp]))))
+    np.testing.assert_allclose(dps['approx_deltaR'], 2 * dps['m'] / dps['pt'])